@@ -1,10 +1,13 @@
+import uuid
+
 import pandas as pd
 import dash
+import flask
 from dash import dcc, html, dash_table
 from dash.dependencies import Input, Output, State
-from sqlalchemy import create_engine
-import urllib
-import numpy as np
+
+import data_store
+import result_cache
 
 # Define dropdown style with increased font size
 dropdown_style = {
@@ -69,6 +72,23 @@ accounts_layout = html.Div([
 ], style={"backgroundColor": "black", "padding": "30px", "minHeight": "100vh"})
 
 
+def filter_accounts(df, selected_owner, selected_score):
+    if selected_owner and 'All' not in selected_owner:
+        df = df[df['Account Owner Name'].isin(selected_owner)]
+    if selected_score and 'All' not in selected_score:
+        df = df[df['Score Bucket'].isin(selected_score)]
+    return df
+
+
+# Filtered frames are kept per browser session (a random id in the signed
+# Flask session cookie) and filter set, in the size-bounded result cache
+def export_key(selected_owner, selected_score):
+    if 'account_score_sid' not in flask.session:
+        flask.session['account_score_sid'] = uuid.uuid4().hex
+    return ('account_score_export', flask.session['account_score_sid'],
+            result_cache.normalize_args([selected_owner, selected_score]), data_store.snapshot('ACCOUNTS').version)
+
+
 # Callback Registration Function
 def register_accounts_callbacks(app):
     @app.callback(
@@ -86,42 +106,20 @@ def register_accounts_callbacks(app):
     )
     def update_table(selected_owner, selected_score):
         try:
-            server = 'valentasql.database.windows.net'
-            database = 'Xero_CRM'
-            username = 'valdb'
-            password = 'Valenta@1234'
-            table_name = 'dbo.ACCOUNTS'
-
-            params = urllib.parse.quote_plus(
-                f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-                f"SERVER={server};DATABASE={database};UID={username};PWD={password};"
-            )
-
-            engine = create_engine(f"mssql+pyodbc:///?odbc_connect={params}")
-            df = pd.read_sql(f"SELECT * FROM {table_name}", engine)
-
-            df = df.rename(columns=lambda x: x.strip())
-            df = df[['Account Name', 'Account Owner Name', 'Existing Account']]
-
-            # Simulate Score Bucket
-            np.random.seed(42)
-            df['Score Bucket'] = np.random.choice(
-                ['Under 50', '50-100', '100-150', 'Over 150'],
-                size=len(df),
-                p=[0.7, 0.2, 0.05, 0.05]
-            )
-
+            # Cached by data_store (reloaded in the background every
+            # ACCOUNTS_TTL_SECONDS), so filter changes don't go back to the
+            # database
+            df = data_store.accounts()
+            key = export_key(selected_owner, selected_score)
         except Exception as e:
             print(f"Error fetching Accounts data: {e}")
             df = pd.DataFrame(columns=['Account Name', 'Account Owner Name', 'Existing Account', 'Score Bucket'])
+            key = None
 
         # Filters
-        if selected_owner and 'All' not in selected_owner:
-            df = df[df['Account Owner Name'].isin(selected_owner)]
-        if selected_score and 'All' not in selected_score:
-            df = df[df['Score Bucket'].isin(selected_score)]
-
-        app.server.df_account_score = df.copy()
+        df = filter_accounts(df, selected_owner, selected_score)
+        if key is not None:
+            result_cache.put(key, df, df.memory_usage(deep=True).sum())
 
         owner_options = [{'label': owner, 'value': owner}
                          for owner in sorted(df['Account Owner Name'].dropna().unique())]
@@ -181,10 +179,20 @@ def register_accounts_callbacks(app):
     @app.callback(
         Output("download-account-score-csv", "data"),
         Input("export-csv-button", "n_clicks"),
+        State('account-score-owner-filter', 'value'),
+        State('account-score-score-filter', 'value'),
         prevent_initial_call=True
     )
-    def export_csv(n_clicks):
-        df = getattr(app.server, 'df_account_score', pd.DataFrame())
+    def export_csv(n_clicks, selected_owner, selected_score):
+        # Another worker may have served the table, or the entry was evicted:
+        # refilter the cached ACCOUNTS frame then
+        try:
+            df = result_cache.get(export_key(selected_owner, selected_score))
+            if df is None:
+                df = filter_accounts(data_store.accounts(), selected_owner, selected_score)
+        except Exception as e:
+            print(f"Error fetching Accounts data: {e}")
+            return dash.no_update
         if not df.empty:
             return dcc.send_data_frame(df.to_csv, "Account_Score_Data.csv", index=False)
         return dash.no_update
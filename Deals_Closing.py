@@ -1,40 +1,17 @@
+import numpy as np
 import pandas as pd
 from dash import dcc, html, Input, Output, State, callback_context
 import dash_table
 import plotly.graph_objects as go
-import urllib
-import sqlalchemy
-import dash
 from dash.exceptions import PreventUpdate
 
-# SQL Server Connection
-server = 'valentasql.database.windows.net'
-database = 'Xero_CRM'
-username = 'valdb'
-password = 'Valenta@1234'
-table_name = 'dbo.DEALS'
-
-params = urllib.parse.quote_plus(
-    f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-    f"SERVER={server};"
-    f"DATABASE={database};"
-    f"UID={username};"
-    f"PWD={password};"
-)
-engine = sqlalchemy.create_engine(f"mssql+pyodbc:///?odbc_connect={params}")
-df = pd.read_sql(f"SELECT * FROM {table_name}", engine)
-
-# Preprocessing
-df['Created Time'] = pd.to_datetime(df['Created Time'], errors='coerce')
-df['Closing Date'] = pd.to_datetime(df['Closing Date'], errors='coerce')
-df['Stage'] = df['Stage'].fillna('')
-df['Deal Owner Name'] = df['Deal Owner Name'].fillna('Unknown')
-df['# Deals Entered'] = 1
-closed_stages = ['Closed-Won', 'Closed (Lost)', 'Closed (Future prospect)']
-df['Is Closed'] = df['Stage'].isin(closed_stages)
-
-deal_owners = sorted(df['Deal Owner Name'].unique())
-service_lines = sorted(df['Service Line'].dropna().unique())
+import data_store
+import deal_cohorts
+import filter_index
+import result_cache
+
+# Columns this page reads from DEALS
+data_store.require_columns('DEALS', ['Deal Owner Name', 'Deal Name', 'Service Line', 'Stage'])
 
 # Dropdown style as requested
 dropdown_style = {
@@ -50,44 +27,115 @@ dropdown_style = {
 }
 
 # ===================== Layout =====================
-deals_closing_layout = html.Div(style={'backgroundColor': '#111', 'padding': '15px'}, children=[
-    html.Div([
-        html.Div([
-            dcc.Dropdown(
-                id='service-filter-deals-closing',
-                options=[{'label': i, 'value': i} for i in service_lines],
-                placeholder="Select Service Line",
-                clearable=True,
-                multi=True,
-                style=dropdown_style
-            ),
-        ], style={'marginRight': '20px'}),
+def deals_closing_layout():
+    df = data_store.deals()
+    deal_owners = sorted(df['Deal Owner Name'].fillna('Unknown').unique())
+    service_lines = sorted(df['Service Line'].dropna().unique())
 
+    return html.Div(style={'backgroundColor': '#111', 'padding': '15px'}, children=[
         html.Div([
-            dcc.Dropdown(
-                id='owner-filter-deals-closing',
-                options=[{'label': i, 'value': i} for i in deal_owners],
-                placeholder="Select Deal Owner",
-                clearable=True,
-                multi=True,
-                style=dropdown_style
-            ),
+            html.Div([
+                dcc.Dropdown(
+                    id='service-filter-deals-closing',
+                    options=[{'label': i, 'value': i} for i in service_lines],
+                    placeholder="Select Service Line",
+                    clearable=True,
+                    multi=True,
+                    style=dropdown_style
+                ),
+            ], style={'marginRight': '20px'}),
+
+            html.Div([
+                dcc.Dropdown(
+                    id='owner-filter-deals-closing',
+                    options=[{'label': i, 'value': i} for i in deal_owners],
+                    placeholder="Select Deal Owner",
+                    clearable=True,
+                    multi=True,
+                    style=dropdown_style
+                ),
+            ]),
+        ], style={'display': 'flex', 'marginBottom': '20px'}),
+
+        html.Div(id='kpi-cards-deals-closing', style={'display': 'flex', 'marginBottom': '20px', 'gap': '15px'}),
+
+        html.Div(style={'display': 'flex'}, children=[
+            html.Div([
+                html.Div(id='data-table-deals-closing'),
+                html.Button("Export to CSV", id="export-btn-deals-closing", n_clicks=0,
+                            style={'marginTop': '10px', 'backgroundColor': '#FFD700', 'color': 'black',
+                                   'fontWeight': 'bold', 'border': 'none', 'borderRadius': '5px', 'padding': '8px'}),
+                dcc.Download(id="download-deals-closing")
+            ], style={'width': '50%', 'paddingRight': '10px'}),
+            html.Div(id='bar-chart-deals-closing', style={'width': '50%', 'paddingLeft': '10px'}),
         ]),
-    ], style={'display': 'flex', 'marginBottom': '20px'}),
-
-    html.Div(id='kpi-cards-deals-closing', style={'display': 'flex', 'marginBottom': '20px', 'gap': '15px'}),
 
-    html.Div(style={'display': 'flex'}, children=[
-        html.Div([
-            html.Div(id='data-table-deals-closing'),
-            html.Button("Export to CSV", id="export-btn-deals-closing", n_clicks=0,
-                        style={'marginTop': '10px', 'backgroundColor': '#FFD700', 'color': 'black',
-                               'fontWeight': 'bold', 'border': 'none', 'borderRadius': '5px', 'padding': '8px'}),
-            dcc.Download(id="download-deals-closing")
-        ], style={'width': '50%', 'paddingRight': '10px'}),
-        html.Div(id='bar-chart-deals-closing', style={'width': '50%', 'paddingLeft': '10px'}),
+        dcc.Graph(id='cohort-heatmap-deals-closing', style={'marginTop': '20px'})
     ])
-])
+
+# The page filters service lines through the filter index, and owners through
+# the deal codes, where a missing owner is "Unknown"
+filter_index.register('DEALS', ['Service Line'])
+
+
+def deal_rows(snapshot, selected_owner, selected_service):
+    rows = filter_index.rows(snapshot, [('Service Line', selected_service)])
+    if not selected_owner:
+        return rows
+    owners, names, _, _ = snapshot.derived('deal_codes', deal_cohorts.build_deal_codes)
+    if rows is None:
+        rows = np.arange(len(owners))
+    return rows[np.isin(owners[rows], names.get_indexer(selected_owner))]
+
+
+# Distinct deals entered and closed per owner of rows (all rows if None), in
+# one pass: the distinct codes with the closed bit set are the closed deals,
+# and dropping the bit leaves the (much shorter) list to take the entered
+# deals from.
+def owner_counts(snapshot, rows):
+    owners, names, codes, width = snapshot.derived('deal_codes', deal_cohorts.build_deal_codes)
+    if rows is not None:
+        owners, codes = owners[rows], codes[rows]
+    codes = pd.unique(codes[codes >= 0])
+
+    present = np.bincount(owners, minlength=len(names)) > 0
+    entered = np.bincount(pd.unique(codes // 2) // width, minlength=len(names))
+    closed = np.bincount(codes[codes % 2 == 1] // 2 // width, minlength=len(names))
+    return names[present], entered[present], closed[present]
+
+
+# Deals entered and closed per owner for the filters, and the total row.
+# Kept in the result cache so the CSV export reuses the summary on screen.
+def summary(selected_owner, selected_service):
+    snapshot = data_store.snapshot('DEALS')
+    key = ('deals_closing_summary', result_cache.normalize_args([selected_owner, selected_service]), snapshot.version)
+    cached = result_cache.get(key)
+    if cached is not None:
+        return cached
+
+    rows = deal_rows(snapshot, selected_owner, selected_service)
+    names, entered, closed = owner_counts(snapshot, rows)
+    grouped = pd.DataFrame({'Deal Owner Name': names, '# Deals Entered': entered, '# Deals Closed': closed})
+    grouped['% Deals Closed'] = ((grouped['# Deals Closed'] / grouped['# Deals Entered']) * 100).round(2)
+
+    total_entered, total_closed = entered.sum(), closed.sum()
+    total_row = {
+        'Deal Owner Name': 'Total',
+        '# Deals Entered': total_entered,
+        '# Deals Closed': total_closed,
+        '% Deals Closed': round(total_closed / total_entered * 100, 2) if total_entered != 0 else 0
+    }
+
+    result_cache.put(key, (grouped, total_row), grouped.memory_usage(deep=True).sum())
+    return grouped, total_row
+
+
+# The owner rows plus the total, with the closed % as text, as in the table
+def summary_table(grouped, total_row):
+    table = pd.concat([grouped, pd.DataFrame([total_row])], ignore_index=True)
+    table['% Deals Closed'] = table['% Deals Closed'].astype(str) + '%'
+    return table
+
 
 # ===================== Callbacks =====================
 def register_deals_closing_callbacks(app):
@@ -98,37 +146,10 @@ def register_deals_closing_callbacks(app):
         [Input('owner-filter-deals-closing', 'value'),
          Input('service-filter-deals-closing', 'value')],
     )
+    @result_cache.memoize('deals_closing', 'DEALS')
     def update_dashboard(selected_owner, selected_service):
-        filtered_df = df.copy()
-        if selected_owner:
-            filtered_df = filtered_df[filtered_df['Deal Owner Name'].isin(selected_owner)]
-        if selected_service:
-            filtered_df = filtered_df[filtered_df['Service Line'].isin(selected_service)]
-
-        entered_group = filtered_df.groupby('Deal Owner Name').agg({
-            'Deal Name': pd.Series.nunique
-        }).reset_index().rename(columns={'Deal Name': '# Deals Entered'})
-
-        closed_df = filtered_df[filtered_df['Is Closed']]
-        closed_group = closed_df.groupby('Deal Owner Name').agg({
-            'Deal Name': pd.Series.nunique
-        }).reset_index().rename(columns={'Deal Name': '# Deals Closed'})
-
-        grouped = pd.merge(entered_group, closed_group, on='Deal Owner Name', how='left')
-        grouped['# Deals Closed'] = grouped['# Deals Closed'].fillna(0).astype(int)
-        grouped['% Deals Closed'] = ((grouped['# Deals Closed'] / grouped['# Deals Entered']) * 100).round(2)
-
-        total_row = {
-            'Deal Owner Name': 'Total',
-            '# Deals Entered': grouped['# Deals Entered'].sum(),
-            '# Deals Closed': grouped['# Deals Closed'].sum(),
-            '% Deals Closed': round(
-                grouped['# Deals Closed'].sum() / grouped['# Deals Entered'].sum() * 100, 2
-            ) if grouped['# Deals Entered'].sum() != 0 else 0
-        }
-
-        grouped = pd.concat([grouped, pd.DataFrame([total_row])], ignore_index=True)
-        grouped['% Deals Closed'] = grouped['% Deals Closed'].astype(str) + '%'
+        summary_grouped, total_row = summary(selected_owner, selected_service)
+        grouped = summary_table(summary_grouped, total_row)
 
         grouped_no_total = grouped[grouped['Deal Owner Name'] != 'Total']
 
@@ -228,42 +249,39 @@ def register_deals_closing_callbacks(app):
     def export_csv(n_clicks, selected_owner, selected_service):
         if n_clicks is None or n_clicks == 0:
             raise PreventUpdate
-        filtered_df = df.copy()
-        if selected_owner:
-            filtered_df = filtered_df[filtered_df['Deal Owner Name'].isin(selected_owner)]
-        if selected_service:
-            filtered_df = filtered_df[filtered_df['Service Line'].isin(selected_service)]
-
-        entered_group = filtered_df.groupby('Deal Owner Name').agg({
-            'Deal Name': pd.Series.nunique
-        }).reset_index().rename(columns={'Deal Name': '# Deals Entered'})
-
-        closed_df = filtered_df[filtered_df['Is Closed']]
-        closed_group = closed_df.groupby('Deal Owner Name').agg({
-            'Deal Name': pd.Series.nunique
-        }).reset_index().rename(columns={'Deal Name': '# Deals Closed'})
-
-        grouped = pd.merge(entered_group, closed_group, on='Deal Owner Name', how='left')
-        grouped['# Deals Closed'] = grouped['# Deals Closed'].fillna(0).astype(int)
-        grouped['% Deals Closed'] = ((grouped['# Deals Closed'] / grouped['# Deals Entered']) * 100).round(2)
-
-        total_row = {
-            'Deal Owner Name': 'Total',
-            '# Deals Entered': grouped['# Deals Entered'].sum(),
-            '# Deals Closed': grouped['# Deals Closed'].sum(),
-            '% Deals Closed': round(
-                grouped['# Deals Closed'].sum() / grouped['# Deals Entered'].sum() * 100, 2
-            ) if grouped['# Deals Entered'].sum() != 0 else 0
-        }
-
-        grouped = pd.concat([grouped, pd.DataFrame([total_row])], ignore_index=True)
-        grouped['% Deals Closed'] = grouped['% Deals Closed'].astype(str) + '%'
-
+        grouped = summary_table(*summary(selected_owner, selected_service))
         return dcc.send_data_frame(grouped.to_csv, "Deals_Closing_Export.csv", index=False)
 
-
-# ===================== Dash App Setup =====================
-app = dash.Dash(__name__)
-app.layout = deals_closing_layout
-register_deals_closing_callbacks(app)
-
+    @app.callback(
+        Output('cohort-heatmap-deals-closing', 'figure'),
+        [Input('owner-filter-deals-closing', 'value'),
+         Input('service-filter-deals-closing', 'value')],
+    )
+    @result_cache.memoize('deals_closing_cohorts', 'DEALS')
+    def update_cohorts(selected_owner, selected_service):
+        snapshot = data_store.snapshot('DEALS')
+        rows = deal_rows(snapshot, selected_owner, selected_service)
+        rates, deals = deal_cohorts.matrix(snapshot, rows)
+
+        heatmap_fig = go.Figure(go.Heatmap(
+            z=rates.to_numpy(),
+            x=[str(months) for months in rates.columns],
+            y=rates.index,
+            customdata=np.repeat(deals.to_numpy()[:, None], len(rates.columns), axis=1),
+            zmin=0,
+            zmax=100,
+            colorscale='YlOrBr',
+            colorbar=dict(title='% Closed', ticksuffix='%'),
+            hovertemplate='Created %{y}<br>Closed within %{x} months: %{z:.1f}%<br>of %{customdata} deals<extra></extra>',
+        ))
+        heatmap_fig.update_layout(
+            plot_bgcolor='#111',
+            paper_bgcolor='#111',
+            font=dict(color='white'),
+            title=dict(text='% Deals Closed by Created Month and Months to Close', x=0.5, xanchor='center'),
+            xaxis=dict(title='Months to Close', type='category'),
+            yaxis=dict(title='Created Month', type='category'),
+            height=max(400, 18 * len(rates) + 150),
+            margin=dict(t=80, l=80, r=10, b=60)
+        )
+        return heatmap_fig
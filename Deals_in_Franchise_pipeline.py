@@ -1,33 +1,13 @@
 import pandas as pd
 import plotly.express as px
 from dash import dcc, html, dash_table, Input, Output
-from sqlalchemy import create_engine
-import urllib
 import datetime
 
-# ✅ Fetch data from SQL Server
-server = 'valentasql.database.windows.net'
-database = 'Xero_CRM'
-username = 'valdb'
-password = 'Valenta@1234'
-table_name = 'dbo.DEALS'
+import data_store
+import result_cache
 
-params = urllib.parse.quote_plus(
-    f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-    f"SERVER={server};DATABASE={database};UID={username};PWD={password};"
-)
-
-engine = create_engine(f"mssql+pyodbc:///?odbc_connect={params}")
-df = pd.read_sql(f"SELECT * FROM {table_name}", engine)
-
-# ✅ Clean and preprocess data
-df["Amount"] = df["Amount"].replace({r'\$': '', ',': ''}, regex=True).astype(float)
-df["Closing Date"] = pd.to_datetime(df["Closing Date"], errors='coerce')
-df["Closing Month"] = df["Closing Date"].dt.strftime("%b-%Y")
-
-# ✅ Time References
-current_month = pd.Timestamp.now().strftime("%b-%Y")
-next_month = (pd.Timestamp.now() + pd.DateOffset(months=1)).strftime("%b-%Y")
+# Columns this page reads from DEALS
+data_store.require_columns('DEALS', ['Deal Owner Name', 'Stage', 'Closing Date', 'Amount', 'Region'])
 
 # ✅ Franchise Valid Stages
 valid_stages = [
@@ -36,46 +16,48 @@ valid_stages = [
 ]
 
 # ✅ Layout
-franchise_layout = html.Div(style={"backgroundColor": "black", "color": "white", "padding": "10px"}, children=[
-
-    html.Div([
-        dcc.Dropdown(id="franchise_deal_owner",
-                     multi=True,  # ✅ Enable multiple selection
-                     options=[{"label": i, "value": i} for i in sorted(df["Deal Owner Name"].dropna().unique())],
-                     placeholder="Deal Owner Name",
-                     style={"flex": 1, "backgroundColor": "white", "color": "green", "border": "2px solid white"}),
-
-        dcc.Dropdown(id="franchise_closing_month",
-                     multi=True,  # ✅ Enable multiple selection
-                     options=[
-                         {"label": "This Month", "value": "this_month"},
-                         {"label": "Next Month", "value": "next_month"},
-                         {"label": "Other", "value": "other"}
-                     ],
-                     placeholder="Closing Month",
-                     style={"flex": 1, "backgroundColor": "white", "color": "green", "border": "2px solid white"}),
-
-        dcc.Dropdown(id="franchise_region",
-                     multi=True,  # ✅ Enable multiple selection
-                     options=[{"label": "All", "value": "All"}] + (
-                         [{"label": i, "value": i} for i in sorted(df["Region"].dropna().unique())]
-                         if "Region" in df.columns else []
-                     ),
-                     placeholder="Region",
-                     style={"flex": 1, "backgroundColor": "white", "color": "green", "border": "2px solid white"})
-    ], style={"display": "flex", "gap": "10px", "padding": "10px"}),
-
-    html.Div(id="franchise_kpi_cards", style={"display": "flex", "justifyContent": "space-around", "padding": "20px"}),
-
-    html.Div([
-        dash_table.DataTable(id="franchise_stage_table",
-                             style_table={"width": "100%", "backgroundColor": "black"},
-                             style_header={"backgroundColor": "black", "color": "white", "fontWeight": "bold"},
-                             style_cell={"backgroundColor": "black", "color": "white", "textAlign": "center"})
-    ], style={"padding": "10px"}),
-
-    dcc.Graph(id="franchise_bar_chart")
-])
+def franchise_layout():
+    df = data_store.deals()
+    return html.Div(style={"backgroundColor": "black", "color": "white", "padding": "10px"}, children=[
+
+        html.Div([
+            dcc.Dropdown(id="franchise_deal_owner",
+                         multi=True,  # ✅ Enable multiple selection
+                         options=[{"label": i, "value": i} for i in sorted(df["Deal Owner Name"].dropna().unique())],
+                         placeholder="Deal Owner Name",
+                         style={"flex": 1, "backgroundColor": "white", "color": "green", "border": "2px solid white"}),
+
+            dcc.Dropdown(id="franchise_closing_month",
+                         multi=True,  # ✅ Enable multiple selection
+                         options=[
+                             {"label": "This Month", "value": "this_month"},
+                             {"label": "Next Month", "value": "next_month"},
+                             {"label": "Other", "value": "other"}
+                         ],
+                         placeholder="Closing Month",
+                         style={"flex": 1, "backgroundColor": "white", "color": "green", "border": "2px solid white"}),
+
+            dcc.Dropdown(id="franchise_region",
+                         multi=True,  # ✅ Enable multiple selection
+                         options=[{"label": "All", "value": "All"}] + (
+                             [{"label": i, "value": i} for i in sorted(df["Region"].dropna().unique())]
+                             if "Region" in df.columns else []
+                         ),
+                         placeholder="Region",
+                         style={"flex": 1, "backgroundColor": "white", "color": "green", "border": "2px solid white"})
+        ], style={"display": "flex", "gap": "10px", "padding": "10px"}),
+
+        html.Div(id="franchise_kpi_cards", style={"display": "flex", "justifyContent": "space-around", "padding": "20px"}),
+
+        html.Div([
+            dash_table.DataTable(id="franchise_stage_table",
+                                 style_table={"width": "100%", "backgroundColor": "black"},
+                                 style_header={"backgroundColor": "black", "color": "white", "fontWeight": "bold"},
+                                 style_cell={"backgroundColor": "black", "color": "white", "textAlign": "center"})
+        ], style={"padding": "10px"}),
+
+        dcc.Graph(id="franchise_bar_chart")
+    ])
 
 # ✅ Callbacks
 def register_franchise_callbacks(app):
@@ -88,13 +70,16 @@ def register_franchise_callbacks(app):
          Input("franchise_closing_month", "value"),
          Input("franchise_region", "value")]
     )
+    @result_cache.memoize('franchise_pipeline', 'DEALS')
     def update_franchise(deal_owner, closing_month, region):
+        df = data_store.deals()
         filtered_df = df[df["Stage"].isin(valid_stages)]
 
         if deal_owner:
             filtered_df = filtered_df[filtered_df["Deal Owner Name"].isin(deal_owner)]
 
         if closing_month:
+            current_month, next_month = data_store.closing_months()
             month_filters = []
             if "this_month" in closing_month:
                 month_filters.append(filtered_df["Closing Month"] == current_month)
@@ -2,41 +2,15 @@ import dash
 from dash import dcc, html, Input, Output, dash_table
 import pandas as pd
 import plotly.express as px
-import urllib
-import sqlalchemy
 import warnings
 
-warnings.simplefilter("ignore")
-
-# SQL Server Connection
-server = 'valentasql.database.windows.net'
-database = 'Xero_CRM'
-username = 'valdb'
-password = 'Valenta@1234'
-table_name = 'dbo.DEALS'
-
-params = urllib.parse.quote_plus(
-    f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-    f"SERVER={server};"
-    f"DATABASE={database};"
-    f"UID={username};"
-    f"PWD={password};"
-)
+import data_store
+import result_cache
 
-engine = sqlalchemy.create_engine(f"mssql+pyodbc:///?odbc_connect={params}")
-df = pd.read_sql(f"SELECT * FROM {table_name}", engine)
-
-# Clean numeric columns
-for col in ["Amount", "Consulting Fee"]:
-    if col in df.columns and not df[col].isnull().all():
-        df[col] = df[col].astype(str).replace({r'[$,]': ''}, regex=True)
-        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-
-df["Closing Date"] = pd.to_datetime(df["Closing Date"], errors='coerce')
-df["Closing Month"] = df["Closing Date"].dt.strftime("%b-%Y")
+warnings.simplefilter("ignore")
 
-current_month = pd.Timestamp.now().strftime("%b-%Y")
-next_month = (pd.Timestamp.now() + pd.DateOffset(months=1)).strftime("%b-%Y")
+# Columns this page reads from DEALS
+data_store.require_columns('DEALS', ['Deal Owner Name', 'Stage', 'Closing Date', 'Amount', 'Consulting Fee'])
 
 # Dropdown Style
 dropdown_style = {
@@ -138,7 +112,9 @@ def register_client_callbacks(app):
         [Input("deal_owner", "value"),
          Input("closing_month", "value")]
     )
+    @result_cache.memoize('client_pipeline', 'DEALS')
     def update_dashboard(deal_owner, closing_month):
+        df = data_store.deals()
         filtered_df = df[df["Stage"].isin([
             "Agreement Signed", "Awareness", "Closed (Future prospect)", "Closed (Lost)", "Did Not Proceed",
             "Discovery", "Engagement Completed", "Implementation", "Issue Agreement", "Needs Identified",
@@ -149,6 +125,7 @@ def register_client_callbacks(app):
             filtered_df = filtered_df[filtered_df["Deal Owner Name"].isin(deal_owner)]
 
         if closing_month:
+            current_month, next_month = data_store.closing_months()
             filters = []
             if "this_month" in closing_month:
                 filters.append(df["Closing Month"] == current_month)
@@ -1,34 +1,14 @@
-import pandas as pd
-import urllib
-import sqlalchemy
+import numpy as np
 from dash import html, dcc, Input, Output
 import dash_bootstrap_components as dbc
 import plotly.graph_objs as go
 
-# Database configuration
-server = 'valentasql.database.windows.net'
-database = 'Xero_CRM'
-username = 'valdb'
-password = 'Valenta@1234'
-table_name = 'dbo.INVOICES'
-
-# SQLAlchemy connection
-params = urllib.parse.quote_plus(
-    f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={server};DATABASE={database};UID={username};PWD={password};"
-)
-engine = sqlalchemy.create_engine(f"mssql+pyodbc:///?odbc_connect={params}")
-df = pd.read_sql(f"SELECT * FROM {table_name}", engine)
-
-# Preprocess
-df['Invoice_Date'] = pd.to_datetime(df['Invoice_Date'])
-df['Year'] = df['Invoice_Date'].dt.year
-df['Quarter'] = df['Invoice_Date'].dt.to_period("Q").astype(str)
-df['Month'] = df['Invoice_Date'].dt.month_name()
-
-years = sorted(df['Year'].dropna().unique())
-years = [str(int(year)) for year in years]
-quarters = sorted(df['Quarter'].dropna().unique())
-months = df['Month'].dropna().unique()
+import data_store
+import invoice_cube
+import result_cache
+
+# Columns this page reads from INVOICES
+data_store.require_columns('INVOICES', ['Invoice_Entity', 'Location', 'Invoice_Amount_USD', 'Quantity'])
 
 # KPI Card (Updated)
 def styled_card(value, label, color):
@@ -76,69 +56,76 @@ def styled_card(value, label, color):
     })
 
 # Layout
-layout = dbc.Container([
-    html.Div([], className="mb-3 text-center"),
-
-    dbc.Row([
-        dbc.Col(dcc.Dropdown(
-            options=[{"label": str(y), "value": str(y)} for y in years],
-            value=None,
-            id="year-dropdown",
-            placeholder="Select Year",
-            style={"color": "black"},
-            multi=True
-        ), width=3),
-        dbc.Col(dcc.Dropdown(
-            options=[{"label": q, "value": q} for q in quarters],
-            value=None,
-            id="quarter-dropdown",
-            placeholder="Select Quarter",
-            style={"color": "black"},
-            multi=True
-        ), width=3),
-        dbc.Col(dcc.Dropdown(
-            options=[{"label": m, "value": m} for m in months],
-            value=None,
-            id="month-dropdown",
-            placeholder="Select Month",
-            style={"color": "black"},
-            multi=True
-        ), width=3),
-    ], className="mb-4 justify-content-center"),
-
-    dbc.Row([
-        dbc.Col(html.Div(id="invoice-amount-card"), xs=6, sm=4, md=2),
-        dbc.Col(html.Div(id="paid-amount-card"), xs=6, sm=4, md=2),
-        dbc.Col(html.Div(id="paid-percent-card"), xs=6, sm=4, md=2),
-        dbc.Col(html.Div(id="receivables-card"), xs=6, sm=4, md=2),
-        dbc.Col(html.Div(id="receivables-percent-card"), xs=6, sm=4, md=2),
-    ], className="gx-2 gy-2 mb-4 justify-content-center"),
-
-    dbc.Row([
-        dbc.Col(dcc.Graph(id="entity-table", style={"height": "600px"}, config={"modeBarButtonsToRemove": ["toImage"]}), width=6),
-        dbc.Col(dcc.Graph(id="invoice-receivable-chart"), width=6)
-    ])
-], fluid=True, style={"backgroundColor": "#000000", "color": "white", "padding": "20px"})
+def layout():
+    df = data_store.invoices()
+    years = sorted(df['Year'].dropna().unique())
+    quarters = sorted(df['Quarter'].dropna().unique())
+    months = df['Month'].dropna().unique()
+
+    return dbc.Container([
+        html.Div([], className="mb-3 text-center"),
+
+        dbc.Row([
+            dbc.Col(dcc.Dropdown(
+                options=[{"label": str(y), "value": str(y)} for y in years],
+                value=None,
+                id="year-dropdown",
+                placeholder="Select Year",
+                style={"color": "black"},
+                multi=True
+            ), width=3),
+            dbc.Col(dcc.Dropdown(
+                options=[{"label": q, "value": q} for q in quarters],
+                value=None,
+                id="quarter-dropdown",
+                placeholder="Select Quarter",
+                style={"color": "black"},
+                multi=True
+            ), width=3),
+            dbc.Col(dcc.Dropdown(
+                options=[{"label": m, "value": m} for m in months],
+                value=None,
+                id="month-dropdown",
+                placeholder="Select Month",
+                style={"color": "black"},
+                multi=True
+            ), width=3),
+        ], className="mb-4 justify-content-center"),
+
+        dbc.Row([
+            dbc.Col(html.Div(id="invoice-amount-card"), xs=6, sm=4, md=2),
+            dbc.Col(html.Div(id="paid-amount-card"), xs=6, sm=4, md=2),
+            dbc.Col(html.Div(id="paid-percent-card"), xs=6, sm=4, md=2),
+            dbc.Col(html.Div(id="receivables-card"), xs=6, sm=4, md=2),
+            dbc.Col(html.Div(id="receivables-percent-card"), xs=6, sm=4, md=2),
+        ], className="gx-2 gy-2 mb-4 justify-content-center"),
+
+        dbc.Row([
+            dbc.Col(dcc.Graph(id="entity-table", style={"height": "600px"}, config={"modeBarButtonsToRemove": ["toImage"]}), width=6),
+            dbc.Col(dcc.Graph(id="invoice-receivable-chart"), width=6)
+        ])
+    ], fluid=True, style={"backgroundColor": "#000000", "color": "white", "padding": "20px"})
 
 
 # Dashboard update logic
+@result_cache.memoize('entity_breakdown', 'INVOICES')
 def update_dashboard(year, quarter, month, user_data):
     username = user_data.get("username")
-    dff = df.copy()
+    # Answer from the pre-aggregated cube instead of scanning every invoice
+    dff = invoice_cube.cube()
 
     if username != 'admin':
         dff = dff[dff["Location"] == username]
 
     if year:
-        dff = dff[dff['Year'].isin([int(y) for y in year])]
+        dff = dff[dff['Year'].isin(year)]
     if quarter:
         dff = dff[dff['Quarter'].isin(quarter)]
     if month:
         dff = dff[dff['Month'].isin(month)]
 
     total_invoice = dff['Invoice_Amount_USD'].sum()
-    paid_amount = dff['Invoice_Amount_USD'] - dff['Quantity']
-    total_paid = paid_amount.sum()
+    total_paid = dff['Paid_Amount'].sum()
     receivables = total_invoice - total_paid
 
     paid_pct = round((total_paid / total_invoice) * 100, 2) if total_invoice else 0
@@ -155,32 +142,31 @@ def update_dashboard(year, quarter, month, user_data):
     by_entity['Receivables %'] = (by_entity['Receivables'] / by_entity['Invoice_Amount_USD']) * 100
     by_entity = by_entity.drop(columns=['Quantity'])
 
-    total_row = pd.DataFrame({
-        'Invoice_Entity': ['Total'],
-        'Invoice_Amount_USD': [by_entity['Invoice_Amount_USD'].sum()],
-        'Paid_Amount': [by_entity['Paid_Amount'].sum()],
-        'Paid %': [round((by_entity['Paid_Amount'].sum() / by_entity['Invoice_Amount_USD'].sum()) * 100, 2)],
-        'Receivables': [by_entity['Receivables'].sum()],
-        'Receivables %': [round((by_entity['Receivables'].sum() / by_entity['Invoice_Amount_USD'].sum()) * 100, 2)]
-    })
-    by_entity = pd.concat([by_entity, total_row], ignore_index=True)
-
-    for col in ['Invoice_Amount_USD', 'Paid_Amount', 'Receivables']:
-        by_entity[col] = by_entity[col].apply(lambda x: f"{x:,.0f}")
-    by_entity['Paid %'] = by_entity['Paid %'].apply(lambda x: f"{x:.2f}%")
-    by_entity['Receivables %'] = by_entity['Receivables %'].apply(lambda x: f"{x:.2f}%")
+    # Total row from the entity aggregates, appended to each column array
+    total_invoice_amount = by_entity['Invoice_Amount_USD'].sum()
+    totals = {
+        'Invoice_Entity': 'Total',
+        'Invoice_Amount_USD': total_invoice_amount,
+        'Paid_Amount': by_entity['Paid_Amount'].sum(),
+        'Paid %': round((by_entity['Paid_Amount'].sum() / total_invoice_amount) * 100, 2),
+        'Receivables': by_entity['Receivables'].sum(),
+        'Receivables %': round((by_entity['Receivables'].sum() / total_invoice_amount) * 100, 2)
+    }
+    columns = list(totals)
+    values = [np.append(by_entity[col].to_numpy(dtype=object if col == 'Invoice_Entity' else float), totals[col])
+              for col in columns]
 
+    # Numbers go to the browser as numbers and plotly formats them there
     by_entity_fig = go.Figure(data=[go.Table(
-        header=dict(values=list(by_entity.columns),
+        header=dict(values=columns,
                     fill_color="#2a2a2a",
                     font=dict(color="white", size=16),
                     align="left",
                     height=32),
-        cells=dict(values=[by_entity[col] for col in by_entity.columns],
-                   fill_color=[
-                       ['#1f1f1f'] * (len(by_entity) - 1) + ['#333333']
-                       for _ in range(len(by_entity.columns))
-                   ],
+        cells=dict(values=values,
+                   format=[None, ",.0f", ",.0f", ".2f", ",.0f", ".2f"],
+                   suffix=[None, None, None, "%", None, "%"],
+                   fill_color=[['#1f1f1f'] * len(by_entity) + ['#333333']] * len(columns),
                    font=dict(color="white", size=15),
                    align="left",
                    height=30)
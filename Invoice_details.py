@@ -1,119 +1,118 @@
-import pandas as pd
 import calendar
-from dash import html, dcc, dash_table, Input, Output, callback, State
-import sqlalchemy
-import urllib
+from dash import html, dcc, dash_table, Input, Output, State
 import dash
-import io
-
-# SQL Connection
-server = 'valentasql.database.windows.net'
-database = 'Xero_CRM'
-username = 'valdb'
-password = 'Valenta@1234'
-table_name = 'dbo.INVOICES'
-
-params = urllib.parse.quote_plus(
-    f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-    f"SERVER={server};DATABASE={database};UID={username};PWD={password};"
-)
+import flask
+import json
 
-engine = sqlalchemy.create_engine(f"mssql+pyodbc:///?odbc_connect={params}")
-df = pd.read_sql(f"SELECT * FROM {table_name}", engine)
+import data_store
+import export_jobs
+import exports
+import filter_index
+import table_paging
 
-# Clean & transform data
-df["Invoice Date"] = pd.to_datetime(df["Invoice_Date"], errors="coerce")
-df = df[df["Invoice Date"].notna()]
-df["Year"] = df["Invoice Date"].dt.year
-df["Month"] = df["Invoice Date"].dt.strftime("%B")
-df["MP"] = df["Location"]
-df["Name"] = df["Client_Name"].fillna("")
-df["Description"] = df["Description"]
-df["Invoice_Amount_USD"] = pd.to_numeric(df["Invoice_Amount_USD"], errors="coerce").abs().fillna(0)
+# Columns this page reads from INVOICES
+data_store.require_columns('INVOICES', ['Description', 'Invoice_Entity'])
 
 month_order = list(calendar.month_name)[1:]
 
-layout = html.Div(style={"backgroundColor": "black", "color": "white"}, children=[
-    html.H2("Invoice Details", style={"textAlign": "center"}),
-
-    html.Div(style={"display": "flex", "gap": "10px", "marginBottom": "20px"}, children=[
-        dcc.Dropdown(
-            id="year_filter",
-            options=[{"label": str(y), "value": y} for y in sorted(df["Year"].dropna().unique())],
-            placeholder="Select Year",
-            style={"width": "250px", "backgroundColor": "white", 'color': 'green'},
-            className="dropdown-custom",
-            multi=True
-        ),
-        dcc.Dropdown(
-            id="month_filter",
-            options=[{"label": m, "value": m} for m in month_order if m in df["Month"].unique()],
-            placeholder="Select Month",
-            style={"width": "250px", "backgroundColor": "white", 'color': 'green'},
-            className="dropdown-custom",
-            multi=True
-        ),
-        dcc.Dropdown(
-            id="entity_filter",
-            options=[{"label": e, "value": e} for e in sorted(df["Invoice_Entity"].dropna().unique())],
-            placeholder="Select Entity",
-            style={"width": "250px", "backgroundColor": "white", 'color': 'green'},
-            className="dropdown-custom",
-            multi=True
-        ),
-        dcc.Dropdown(
-            id="mp_filter",
-            options=[],  # Will be updated dynamically
-            placeholder="Select MP Code",
-            style={"width": "250px", "backgroundColor": "white", 'color': 'green'},
-            className="dropdown-custom",
-            multi=True
-        )
-    ]),
-
-    dash_table.DataTable(
-        id='invoice_table',
-        columns=[
-            {"name": "MP", "id": "MP"},
-            {"name": "Name", "id": "Name"},
-            {"name": "Description", "id": "Description"},
-            {"name": "Invoice Date", "id": "Invoice Date"},
-            {"name": "Invoice Amount", "id": "Invoice_Amount_USD", "type": "numeric",
-             "format": {"locale": {"symbol": ["$", ""]}, "specifier": "$,.0f"}}
-        ],
-        page_size=20,
-        style_table={"overflowX": "auto"},
-        style_header={"backgroundColor": "#222", "color": "white", "fontWeight": "bold"},
-        style_cell={
-            "backgroundColor": "#111",
-            "color": "white",
-            "padding": "10px",
-            "textAlign": "left"
-        },
-        style_data_conditional=[
-            {'if': {'row_index': 'odd'}, 'backgroundColor': '#1a1a1a'},
-            {'if': {'column_id': 'Invoice_Amount_USD'}, 'textAlign': 'center'}
-        ]
-    ),
-
-    html.Div(
-        style={"display": "flex", "justifyContent": "flex-end", "marginTop": "20px"},
-        children=[
-            html.Button("Export to CSV", id="export_button", style={
+invoice_columns = ["MP", "Name", "Description", "Invoice Date", "Invoice Amount"]
+# Sorting the table by amount slices a precomputed order
+filter_index.register_sort("INVOICES", ["Invoice Amount"])
+
+def layout():
+    df = data_store.invoices()
+    return html.Div(style={"backgroundColor": "black", "color": "white"}, children=[
+        html.H2("Invoice Details", style={"textAlign": "center"}),
+
+        html.Div(style={"display": "flex", "gap": "10px", "marginBottom": "20px"}, children=[
+            dcc.Dropdown(
+                id="year_filter",
+                options=[{"label": str(y), "value": y} for y in sorted(df["Year"].dropna().unique())],
+                placeholder="Select Year",
+                style={"width": "250px", "backgroundColor": "white", 'color': 'green'},
+                className="dropdown-custom",
+                multi=True
+            ),
+            dcc.Dropdown(
+                id="month_filter",
+                options=[{"label": m, "value": m} for m in month_order if m in df["Month"].unique()],
+                placeholder="Select Month",
+                style={"width": "250px", "backgroundColor": "white", 'color': 'green'},
+                className="dropdown-custom",
+                multi=True
+            ),
+            dcc.Dropdown(
+                id="entity_filter",
+                options=[{"label": e, "value": e} for e in sorted(df["Invoice_Entity"].dropna().unique())],
+                placeholder="Select Entity",
+                style={"width": "250px", "backgroundColor": "white", 'color': 'green'},
+                className="dropdown-custom",
+                multi=True
+            ),
+            dcc.Dropdown(
+                id="mp_filter",
+                options=[],  # Will be updated dynamically
+                placeholder="Select MP Code",
+                style={"width": "250px", "backgroundColor": "white", 'color': 'green'},
+                className="dropdown-custom",
+                multi=True
+            )
+        ]),
+
+        dash_table.DataTable(
+            id='invoice_table',
+            columns=[
+                {"name": "MP", "id": "MP"},
+                {"name": "Name", "id": "Name"},
+                {"name": "Description", "id": "Description"},
+                {"name": "Invoice Date", "id": "Invoice Date"},
+                {"name": "Invoice Amount", "id": "Invoice Amount", "type": "numeric",
+                 "format": {"locale": {"symbol": ["$", ""]}, "specifier": "$,.0f"}}
+            ],
+            # Paged, sorted and filtered in update_table; only the visible page is sent
+            page_action="custom",
+            page_current=0,
+            page_size=20,
+            sort_action="custom",
+            sort_mode="multi",
+            sort_by=[],
+            filter_action="custom",
+            filter_query="",
+            style_table={"overflowX": "auto"},
+            style_header={"backgroundColor": "#222", "color": "white", "fontWeight": "bold"},
+            style_cell={
+                "backgroundColor": "#111",
                 "color": "white",
-                "backgroundColor": "green",
-                "padding": "10px 20px",
-                "borderRadius": "5px"
-            })
-        ]
-    ),
+                "padding": "10px",
+                "textAlign": "left"
+            },
+            style_data_conditional=[
+                {'if': {'row_index': 'odd'}, 'backgroundColor': '#1a1a1a'},
+                {'if': {'column_id': 'Invoice Amount'}, 'textAlign': 'center'}
+            ]
+        ),
 
-    dcc.Download(id="download-dataframe-csv"),
+        # Written in the background by export_jobs; the link appears when it's ready
+        html.Div(
+            style={"display": "flex", "justifyContent": "flex-end", "alignItems": "center", "gap": "10px", "marginTop": "20px"},
+            children=[html.Div(id="export_status")] + [
+                html.Button(label, id=f"export_{fmt}_button", n_clicks=0, style={
+                    "color": "white",
+                    "backgroundColor": "green",
+                    "padding": "10px 20px",
+                    "border": "none",
+                    "borderRadius": "5px"
+                })
+                for fmt, label in [("csv", "Export to CSV"), ("parquet", "Export to Parquet"), ("xlsx", "Export to Excel")]
+            ]
+        ),
+        dcc.Store(id="export_job"),
+        dcc.Interval(id="export_poll", interval=1000, disabled=True),
 
-    html.Div(id="total_invoice_amount", style={
-        "marginTop": "20px", "fontSize": "18px", "fontWeight": "bold", "textAlign": "right"
-    })
-])
+        html.Div(id="total_invoice_amount", style={
+            "marginTop": "20px", "fontSize": "18px", "fontWeight": "bold", "textAlign": "right"
+        })
+    ])
 
 
 @dash.callback(
@@ -124,6 +123,7 @@ def update_mp_filter(user_data):
     username = user_data.get("username")
 
     if username == "admin":
+        df = data_store.invoices()
         mp_options = [{"label": mp, "value": mp} for mp in sorted(df["MP"].dropna().unique())]
     else:
         mp_options = [{"label": username, "value": username}]
@@ -131,47 +131,82 @@ def update_mp_filter(user_data):
     return mp_options
 
 
+def invoice_filters(year, month, entity, mp_code, username):
+    filters = [("Year", year), ("Month", month), ("Invoice_Entity", entity), ("Location", mp_code)]
+    if username != "admin":
+        filters.append(("Location", [username]))
+    return filters
+
+
 @dash.callback(
     Output("invoice_table", "data"),
+    Output("invoice_table", "page_count"),
+    Output("invoice_table", "page_current"),
     Output("total_invoice_amount", "children"),
     Input("year_filter", "value"),
     Input("month_filter", "value"),
     Input("entity_filter", "value"),
     Input("mp_filter", "value"),
-    Input("user-store", "data")
+    Input("user-store", "data"),
+    Input("invoice_table", "page_current"),
+    Input("invoice_table", "page_size"),
+    Input("invoice_table", "sort_by"),
+    Input("invoice_table", "filter_query")
 )
-def update_table(year, month, entity, mp_code, user_data):
+def update_table(year, month, entity, mp_code, user_data, page_current, page_size, sort_by, filter_query):
     username = user_data.get("username")
-    dff = df.copy()
+    snapshot = data_store.snapshot("INVOICES")
+    rows = filter_index.ordered_rows(snapshot, invoice_filters(year, month, entity, mp_code, username),
+                                     invoice_columns, sort_by, filter_query)
+    total_amount = snapshot.df["Invoice Amount"].to_numpy()[rows].sum()
 
-    if username != "admin":
-        dff = dff[dff["MP"] == username]
+    # Changing the filters starts again from the first page
+    if not {"invoice_table.page_current", "invoice_table.sort_by"} & set(dash.ctx.triggered_prop_ids):
+        page_current = 0
 
-    if year:
-        dff = dff[dff["Year"].isin(year)]
-    if month:
-        dff = dff[dff["Month"].isin(month)]
-    if entity:
-        dff = dff[dff["Invoice_Entity"].isin(entity)]
-    if mp_code:
-        dff = dff[dff["MP"].isin(mp_code)]
-
-    dff = dff[["MP", "Name", "Description", "Invoice Date", "Invoice_Amount_USD"]].copy()
-    dff["Invoice Date"] = dff["Invoice Date"].dt.strftime("%Y-%m-%d")
-
-    total_amount = dff["Invoice_Amount_USD"].sum()
-    return dff.to_dict("records"), f"Total Invoice Amount: ${total_amount:,.0f}"
+    data, pages = table_paging.page_rows(snapshot.df[invoice_columns], rows, page_current, page_size)
+    return data, pages, page_current, f"Total Invoice Amount: ${total_amount:,.0f}"
 
 
 @dash.callback(
-    Output("download-dataframe-csv", "data"),
-    Input("export_button", "n_clicks"),
-    State("invoice_table", "data"),
+    Output("export_job", "data"),
+    Output("export_status", "children"),
+    Output("export_poll", "disabled"),
+    Input("export_csv_button", "n_clicks"),
+    Input("export_parquet_button", "n_clicks"),
+    Input("export_xlsx_button", "n_clicks"),
+    Input("export_poll", "n_intervals"),
+    State("year_filter", "value"),
+    State("month_filter", "value"),
+    State("entity_filter", "value"),
+    State("mp_filter", "value"),
+    State("invoice_table", "sort_by"),
+    State("invoice_table", "filter_query"),
+    State("export_job", "data"),
     prevent_initial_call=True
 )
-def export_table(n_clicks, table_data):
-    if n_clicks is None or not table_data:
-        return dash.no_update
-    
-    df_export = pd.DataFrame(table_data)
-    return dcc.send_data_frame(df_export.to_csv, "invoice_data.csv", index=False)
+def run_export(csv_clicks, parquet_clicks, xlsx_clicks, n_intervals, year, month, entity, mp_code, sort_by,
+               filter_query, job_id):
+    username = flask.request.authorization.username
+    if dash.ctx.triggered_id != "export_poll":
+        fmt = dash.ctx.triggered_id.split("_")[1]
+        params = dict(year=year, month=month, entity=entity, mp=mp_code, filter_query=filter_query,
+                      sort_by=json.dumps(sort_by) if sort_by else None)
+        job_id = export_jobs.submit("invoices", fmt, params, username)
+    elif not job_id:
+        return dash.no_update, dash.no_update, True
+    status, stopped = export_jobs.status_view(job_id, username)
+    return job_id, status, stopped
+
+
+# Rows for exports of invoices, in the order the table shows them
+def export_rows(args, username):
+    snapshot = data_store.snapshot("INVOICES")
+    filters = invoice_filters(args.getlist("year"), args.getlist("month"), args.getlist("entity"),
+                              args.getlist("mp"), username)
+    rows = filter_index.ordered_rows(snapshot, filters, invoice_columns,
+                                     json.loads(args.get("sort_by", "[]")), args.get("filter_query", ""))
+    return snapshot.df[invoice_columns], rows
+
+
+exports.register("invoices", export_rows, "invoice_data", "INVOICES", invoice_columns)
@@ -1,32 +1,15 @@
 import dash_bootstrap_components as dbc
 from dash import dcc, html, Input, Output, State, Dash, dash_table
-import pandas as pd
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
-import sqlalchemy
-import urllib
-
-# SQL setup
-server = 'valentasql.database.windows.net'
-database = 'Xero_CRM'
-username = 'valdb'
-password = 'Valenta@1234'
-table_name = 'dbo.INVOICES'
-
-params = urllib.parse.quote_plus(
-    f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={server};DATABASE={database};UID={username};PWD={password};"
-)
-engine = sqlalchemy.create_engine(f"mssql+pyodbc:///?odbc_connect={params}")
-df = pd.read_sql(f"SELECT * FROM {table_name}", engine)
-
-# Preprocessing
-df['Invoice_Date'] = pd.to_datetime(df['Invoice_Date'], errors='coerce')
-df['Year'] = df['Invoice_Date'].dt.year
-df['Year'] = df['Year'].fillna(0).astype(int).astype(str)
-df = df[df['Year'] != '0']
-df['Month'] = df['Invoice_Date'].dt.month_name()
-df['AccountCode'] = df['AccountCode'].fillna("Unknown")
-df['Location'] = df['Location'].fillna("Unknown")
+
+import data_store
+import invoice_cube
+import result_cache
+
+# Columns this page reads from INVOICES
+data_store.require_columns('INVOICES', ['Invoice_Entity', 'Location', 'Invoice_Amount_USD', 'Quantity'])
 
 
 def kpi_card(title, value, color="green"):
@@ -48,45 +31,55 @@ def kpi_card(title, value, color="green"):
     )
 
 
-layout = dbc.Container([
-    dbc.Row([
-        dbc.Col(html.H4("All Region Invoice and Commissions Report", className="text-white mt-3"), width=10)
-    ], className="mb-4"),
-
-    dbc.Row([
-        dbc.Col(dcc.Dropdown(options=[{"label": y, "value": y} for y in sorted(df["Year"].dropna().unique())],
-                             placeholder="Year", id="year-filter", className="text-dark", multi=True), width=3),
-        dbc.Col(dcc.Dropdown(options=[{"label": m, "value": m} for m in sorted(df["Month"].dropna().unique())],
-                             placeholder="Month", id="month-filter", className="text-dark", multi=True), width=3),
-        dbc.Col(dcc.Dropdown(options=[{"label": e, "value": e} for e in sorted(df["Invoice_Entity"].dropna().unique())],
-                             placeholder="Invoice Entity", id="entity-filter", className="text-dark", multi=True), width=3),
-        dbc.Col(dcc.Dropdown(id="mpcode-filter", placeholder="MP Code", className="text-dark", multi=True), width=3),
-    ], className="mb-3"),
-
-    dbc.Row(id="kpis", className="mb-4 d-flex flex-row flex-wrap", style={"gap": "10px"}),
-
-    dbc.Row([
-        dbc.Col(html.Div(id="data-table", style={
-            "backgroundColor": "#2d2d2d", "padding": "10px", "borderRadius": "10px", "color": "white",
-            "overflowX": "auto", "maxHeight": "500px", "overflowY": "auto"
-        }), width=8),
+def layout():
+    df = data_store.invoices()
+    return dbc.Container([
+        dbc.Row([
+            dbc.Col(html.H4("All Region Invoice and Commissions Report", className="text-white mt-3"), width=10)
+        ], className="mb-4"),
+
+        dbc.Row([
+            dbc.Col(dcc.Dropdown(options=[{"label": y, "value": y} for y in sorted(df["Year"].dropna().unique())],
+                                 placeholder="Year", id="year-filter", className="text-dark", multi=True), width=3),
+            dbc.Col(dcc.Dropdown(options=[{"label": m, "value": m} for m in sorted(df["Month"].dropna().unique())],
+                                 placeholder="Month", id="month-filter", className="text-dark", multi=True), width=3),
+            dbc.Col(dcc.Dropdown(options=[{"label": e, "value": e} for e in sorted(df["Invoice_Entity"].dropna().unique())],
+                                 placeholder="Invoice Entity", id="entity-filter", className="text-dark", multi=True), width=3),
+            dbc.Col(dcc.Dropdown(id="mpcode-filter", placeholder="MP Code", className="text-dark", multi=True), width=3),
+        ], className="mb-3"),
+
+        dbc.Row(id="kpis", className="mb-4 d-flex flex-row flex-wrap", style={"gap": "10px"}),
+
+        dbc.Row([
+            dbc.Col(html.Div(dcc.Graph(id="data-table", config={"displayModeBar": False}), style={
+                "backgroundColor": "#2d2d2d", "padding": "10px", "borderRadius": "10px", "color": "white",
+                "overflowX": "auto", "maxHeight": "500px", "overflowY": "auto"
+            }), width=8),
+
+            dbc.Col([
+                dcc.Graph(id="line-chart", style={"height": "350px"}),
+                dcc.Graph(id="donut-chart", style={"height": "350px"})
+            ], width=4)
+        ]),
 
-        dbc.Col([
-            dcc.Graph(id="line-chart", style={"height": "350px"}),
-            dcc.Graph(id="donut-chart", style={"height": "350px"})
-        ], width=4)
-    ]),
+        dbc.Row([
+            dbc.Col(html.Button("Export Table", id="export-button", n_clicks=0, className="btn btn-warning")),
+            dcc.Download(id="download-table-csv")
+        ], className="mt-3")
+    ], fluid=True, style={"backgroundColor": "#121212", "padding": "20px"})
 
-    dbc.Row([
-        dbc.Col(html.Button("Export Table", id="export-button", n_clicks=0, className="btn btn-warning")),
-        dcc.Download(id="download-table-csv")
-    ], className="mt-3")
-], fluid=True, style={"backgroundColor": "#121212", "padding": "20px"})
 
+# The filtered cube and the per-MP summary shown in the table. Kept in the
+# result cache so exporting the table reuses the summary on screen.
+def summary(year, month, entity, mpcode, username):
+    snapshot = data_store.snapshot("INVOICES")
+    key = ("overview_summary", result_cache.normalize_args([year, month, entity, mpcode]), username, snapshot.version)
+    cached = result_cache.get(key)
+    if cached is not None:
+        return cached
 
-def update_dashboard(year, month, entity, mpcode, user_data):
-    username = user_data.get("username") if user_data else "admin"
-    dff = df.copy()
+    # Answer from the pre-aggregated cube instead of scanning every invoice
+    dff = snapshot.derived("cube", invoice_cube.build)
 
     if username != 'admin':
         dff = dff[dff["Location"] == username]
@@ -100,11 +93,7 @@ def update_dashboard(year, month, entity, mpcode, user_data):
     if mpcode:
         dff = dff[dff["Location"].isin(mpcode)]
 
-    summary = dff.copy()
-    summary["Paid_Amount"] = summary["Invoice_Amount_USD"] - summary["Quantity"]
-    summary["Receivables"] = summary["Invoice_Amount_USD"] - summary["Paid_Amount"]
-
-    by_mp = summary.groupby("Location").agg({
+    by_mp = dff.groupby("Location").agg({
         "Invoice_Amount_USD": "sum",
         "Paid_Amount": "sum",
         "Receivables": "sum"
@@ -112,6 +101,15 @@ def update_dashboard(year, month, entity, mpcode, user_data):
     by_mp["Paid %"] = round((by_mp["Paid_Amount"] / by_mp["Invoice_Amount_USD"]) * 100, 0)
     by_mp["Receivables %"] = (by_mp["Receivables"] / by_mp["Invoice_Amount_USD"]) * 100
 
+    result_cache.put(key, (dff, by_mp), dff.memory_usage(deep=True).sum() + by_mp.memory_usage(deep=True).sum())
+    return dff, by_mp
+
+
+@result_cache.memoize('overview', 'INVOICES')
+def update_dashboard(year, month, entity, mpcode, user_data):
+    username = user_data.get("username") if user_data else "admin"
+    dff, by_mp = summary(year, month, entity, mpcode, username)
+
     total_row = by_mp[["Invoice_Amount_USD", "Paid_Amount", "Receivables"]].sum()
     total_paid_pct = (total_row["Paid_Amount"] / total_row["Invoice_Amount_USD"]) * 100 if total_row["Invoice_Amount_USD"] else 0
     total_recv_pct = (total_row["Receivables"] / total_row["Invoice_Amount_USD"]) * 100 if total_row["Invoice_Amount_USD"] else 0
@@ -124,42 +122,32 @@ def update_dashboard(year, month, entity, mpcode, user_data):
         kpi_card("Receivables %", f"{total_recv_pct:.2f}%", "red")
     ]
 
-    table_cell_style = {"border": "1px solid white", "padding": "6px", "textAlign": "center"}
-
-    table_header = html.Thead(html.Tr([
-        html.Th("MP Code", style=table_cell_style),
-        html.Th("Invoice Amount", style=table_cell_style),
-        html.Th("Paid Amount", style=table_cell_style),
-        html.Th("Paid %", style=table_cell_style),
-        html.Th("Receivables", style=table_cell_style),
-        html.Th("Receivables %", style=table_cell_style)
-    ]))
-
-    table_rows = [html.Tr([
-        html.Td(row["Location"], style=table_cell_style),
-        html.Td(f"${row['Invoice_Amount_USD']:,.0f}", style=table_cell_style),
-        html.Td(f"${row['Paid_Amount']:,.0f}", style=table_cell_style),
-        html.Td(f"{row['Paid %']:.0f}%", style=table_cell_style),
-        html.Td(f"${row['Receivables']:,.0f}", style=table_cell_style),
-        html.Td(f"{row['Receivables %']:.2f}%", style=table_cell_style)
-    ]) for _, row in by_mp.iterrows()]
-
-    table_rows.append(html.Tr([
-        html.Td(html.B("Total"), style=table_cell_style),
-        html.Td(html.B(f"${total_row['Invoice_Amount_USD']:,.0f}"), style=table_cell_style),
-        html.Td(html.B(f"${total_row['Paid_Amount']:,.0f}"), style=table_cell_style),
-        html.Td(html.B(f"{total_paid_pct:.0f}%"), style=table_cell_style),
-        html.Td(html.B(f"${total_row['Receivables']:,.0f}"), style=table_cell_style),
-        html.Td(html.B(f"{total_recv_pct:.2f}%"), style=table_cell_style)
-    ]))
-
-    table = html.Table(
-        children=[table_header, html.Tbody(table_rows)],
-        style={
-            "width": "100%", "borderCollapse": "collapse", "backgroundColor": "#2d2d2d",
-            "color": "white", "fontSize": "14px", "border": "1px solid white"
-        }
-    )
+    # One column array per field plus the total, formatted in the browser
+    table_columns = ["Location", "Invoice_Amount_USD", "Paid_Amount", "Paid %", "Receivables", "Receivables %"]
+    totals = ["<b>Total</b>", total_row["Invoice_Amount_USD"], total_row["Paid_Amount"], total_paid_pct,
+              total_row["Receivables"], total_recv_pct]
+    values = [np.append(by_mp[col].to_numpy(dtype=object if col == "Location" else float), total)
+              for col, total in zip(table_columns, totals)]
+    # The total row is highlighted, and its numbers are bold through the tags
+    # around them (a cell's prefix and suffix are per row, font weight isn't)
+    rows = len(by_mp)
+    prefix = [None] + [[p] * rows + [f"<b>{p}"] for p in ["$", "$", "", "$", ""]]
+    suffix = [None] + [[s] * rows + [f"{s}</b>"] for s in ["", "", "%", "", "%"]]
+
+    table = go.Figure(data=[go.Table(
+        header=dict(values=["MP Code", "Invoice Amount", "Paid Amount", "Paid %", "Receivables", "Receivables %"],
+                    fill_color="#2d2d2d", line_color="white", font=dict(color="white", size=14),
+                    align="center", height=30),
+        cells=dict(values=values,
+                   format=[None, ",.0f", ",.0f", ".0f", ",.0f", ".2f"],
+                   prefix=prefix,
+                   suffix=suffix,
+                   fill_color=[["#2d2d2d"] * rows + ["#444"]],
+                   line_color="white", font=dict(color="white", size=14),
+                   align="center", height=28)
+    )])
+    table.update_layout(margin=dict(l=0, r=0, t=0, b=0), paper_bgcolor="#2d2d2d", template="none",
+                        height=min(480, 30 + 28 * (rows + 1) + 10))
 
     line_df = dff.groupby("Year")["Invoice_Amount_USD"].sum().reset_index()
     line_fig = px.line(line_df, x="Year", y="Invoice_Amount_USD", markers=True)
@@ -187,7 +175,7 @@ def update_dashboard(year, month, entity, mpcode, user_data):
 def register_callbacks(app):
     app.callback(
         [Output("kpis", "children"),
-         Output("data-table", "children"),
+         Output("data-table", "figure"),
          Output("line-chart", "figure"),
          Output("donut-chart", "figure"),
          Output("mpcode-filter", "options")],
@@ -209,30 +197,6 @@ def register_callbacks(app):
         prevent_initial_call=True
     )
     def export_table(n_clicks, year, month, entity, mpcode, user_data):
-        dff = df.copy()
         username = user_data.get("username") if user_data else "admin"
-
-        if username != "admin":
-            dff = dff[dff["Location"] == username]
-        if year:
-            dff = dff[dff["Year"].isin(year)]
-        if month:
-            dff = dff[dff["Month"].isin(month)]
-        if entity:
-            dff = dff[dff["Invoice_Entity"].isin(entity)]
-        if mpcode:
-            dff = dff[dff["Location"].isin(mpcode)]
-
-        summary = dff.copy()
-        summary["Paid_Amount"] = summary["Invoice_Amount_USD"] - summary["Quantity"]
-        summary["Receivables"] = summary["Invoice_Amount_USD"] - summary["Paid_Amount"]
-
-        by_mp = summary.groupby("Location").agg({
-            "Invoice_Amount_USD": "sum",
-            "Paid_Amount": "sum",
-            "Receivables": "sum"
-        }).reset_index()
-        by_mp["Paid %"] = round((by_mp["Paid_Amount"] / by_mp["Invoice_Amount_USD"]) * 100, 0)
-        by_mp["Receivables %"] = (by_mp["Receivables"] / by_mp["Invoice_Amount_USD"]) * 100
-
+        _, by_mp = summary(year, month, entity, mpcode, username)
         return dcc.send_data_frame(by_mp.to_csv, filename="overview_report.csv")
@@ -1,38 +1,12 @@
-import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from dash import dcc, html, Input, Output
-from sqlalchemy import create_engine
-import urllib
-
-# Fetch data from SSMS
-server = 'valentasql.database.windows.net'
-database = 'Xero_CRM'
-username = 'valdb'
-password = 'Valenta@1234'
-table_name = 'dbo.DEALS'
-
-params = urllib.parse.quote_plus(
-    f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-    f"SERVER={server};"
-    f"DATABASE={database};"
-    f"UID={username};"
-    f"PWD={password};"
-)
-
-engine = create_engine(f"mssql+pyodbc:///?odbc_connect={params}")
-df = pd.read_sql(f"SELECT * FROM {table_name}", engine)
-
-df["Closing Date"] = pd.to_datetime(df["Closing Date"], errors="coerce")
-df["Closing Month"] = df["Closing Date"].dt.strftime("%Y-%m")
-
-current_month = pd.Timestamp.today().strftime("%Y-%m")
-next_month = (pd.Timestamp.today() + pd.DateOffset(months=1)).strftime("%Y-%m")
-
-closing_month_options = {
-    "This Month": current_month,
-    "Next Month": next_month
-}
+
+import data_store
+import result_cache
+
+# Columns this page reads from DEALS
+data_store.require_columns('DEALS', ['Deal Owner Name', 'Stage', 'Closing Date', 'Lead Source', 'Billing Company', 'Service Line'])
 
 service_lines = ["Digital Transformation", "Staff Augmentation", "Consulting Milestone", "Consulting"]
 color_map = {
@@ -45,41 +19,43 @@ color_map = {
 stage_order = ["Agreement Signed", "Issue Agreement", "1st Meeting Complete", "Contact Made", "Proposal Sent"]
 
 # Layout
-graphs_layout = html.Div(
-    style={"backgroundColor": "#222222", "color": "white", "padding": "20px"},
-    children=[
-        html.Div(
-            style={"display": "flex", "justifyContent": "center", "gap": "20px", "marginBottom": "20px"},
-            children=[
-                dcc.Dropdown(
-                    id="deal-owner-dropdown",
-                    options=[{"label": owner, "value": owner} for owner in df["Deal Owner Name"].dropna().unique()],
-                    placeholder="Select Deal Owner",
-                    style={"width": "300px", "color": "green", "fontSize": "14px","background": "white"},
-                    multi=True
-                ),
-                dcc.Dropdown(
-                    id="closing-month-dropdown",
-                    options=[{"label": "This Month", "value": "This Month"},
-                             {"label": "Next Month", "value": "Next Month"}],
-                    placeholder="Select Closing Month",
-                    style={"width": "300px", "color": "green", "fontSize": "14px","background": "white"},
-                    multi=True
-                ),
-            ]
-        ),
-
-        html.Div(
-            style={"display": "grid", "gridTemplateColumns": "1fr 1fr", "gap": "20px"},
-            children=[
-                dcc.Graph(id="lead-source-graph", style={"height": "500px", "width": "100%"}),
-                dcc.Graph(id="billing-company-graph", style={"height": "500px", "width": "100%"}),
-                dcc.Graph(id="service-line-graph", style={"height": "400px", "width": "100%"}),
-                dcc.Graph(id="stage-graph", style={"height": "400px", "width": "100%"}),
-            ]
-        ),
-    ]
-)
+def graphs_layout():
+    df = data_store.deals()
+    return html.Div(
+        style={"backgroundColor": "#222222", "color": "white", "padding": "20px"},
+        children=[
+            html.Div(
+                style={"display": "flex", "justifyContent": "center", "gap": "20px", "marginBottom": "20px"},
+                children=[
+                    dcc.Dropdown(
+                        id="deal-owner-dropdown",
+                        options=[{"label": owner, "value": owner} for owner in df["Deal Owner Name"].dropna().unique()],
+                        placeholder="Select Deal Owner",
+                        style={"width": "300px", "color": "green", "fontSize": "14px","background": "white"},
+                        multi=True
+                    ),
+                    dcc.Dropdown(
+                        id="closing-month-dropdown",
+                        options=[{"label": "This Month", "value": "This Month"},
+                                 {"label": "Next Month", "value": "Next Month"}],
+                        placeholder="Select Closing Month",
+                        style={"width": "300px", "color": "green", "fontSize": "14px","background": "white"},
+                        multi=True
+                    ),
+                ]
+            ),
+
+            html.Div(
+                style={"display": "grid", "gridTemplateColumns": "1fr 1fr", "gap": "20px"},
+                children=[
+                    dcc.Graph(id="lead-source-graph", style={"height": "500px", "width": "100%"}),
+                    dcc.Graph(id="billing-company-graph", style={"height": "500px", "width": "100%"}),
+                    dcc.Graph(id="service-line-graph", style={"height": "400px", "width": "100%"}),
+                    dcc.Graph(id="stage-graph", style={"height": "400px", "width": "100%"}),
+                ]
+            ),
+        ]
+    )
 
 # Callback
 def register_graphs_callbacks(app):
@@ -91,8 +67,9 @@ def register_graphs_callbacks(app):
         [Input("deal-owner-dropdown", "value"),
          Input("closing-month-dropdown", "value")]
     )
+    @result_cache.memoize('service_and_lead', 'DEALS')
     def update_graphs(selected_deal_owners, selected_closing_months):
-        df_filtered = df.copy()
+        df_filtered = data_store.deals()
 
         # Handle multi-selection for Deal Owner
         if selected_deal_owners:
@@ -100,6 +77,7 @@ def register_graphs_callbacks(app):
 
         # Handle multi-selection for Closing Month
         if selected_closing_months:
+            closing_month_options = dict(zip(["This Month", "Next Month"], data_store.closing_months()))
             selected_month_values = [closing_month_options[month] for month in selected_closing_months if month in closing_month_options]
             df_filtered = df_filtered[df_filtered["Closing Month"].isin(selected_month_values)]
 
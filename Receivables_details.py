@@ -1,126 +1,171 @@
-import pandas as pd
-from dash import html, dcc, dash_table, Input, Output, callback, ctx
-from datetime import datetime
-import sqlalchemy
-import urllib
-from dash.dcc import send_data_frame, Download
+import numpy as np
+import plotly.graph_objects as go
+from dash import html, dcc, dash_table, Input, Output, State, callback, ctx
 import dash
+import flask
+import json
+import urllib.parse
 
-# SQL Connection
-server = 'valentasql.database.windows.net'
-database = 'Xero_CRM'
-username = 'valdb'
-password = 'Valenta@1234'
-table_name = 'dbo.INVOICES'
+import data_store
+import export_jobs
+import exports
+import filter_index
+import receivables_aging
+import result_cache
+import table_paging
 
-params = urllib.parse.quote_plus(
-    f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-    f"SERVER={server};DATABASE={database};UID={username};PWD={password};"
-)
+# Columns this page reads from INVOICES
+data_store.require_columns('INVOICES', ['Description', 'Invoice_Entity'])
 
-engine = sqlalchemy.create_engine(f"mssql+pyodbc:///?odbc_connect={params}")
-df = pd.read_sql(f"SELECT * FROM {table_name}", engine)
 
-# Prepare data
-df['Name'] = df['Client_Name']
-df['Due Date'] = pd.to_datetime(df['Invoice_DueDate']).dt.strftime('%Y-%m-%d')
-df['Invoice_Date'] = pd.to_datetime(df['Invoice_Date'], errors='coerce')
+# Sorting the table by these columns slices a precomputed order
+filter_index.register_sort('INVOICES', ['Days Overdue', 'Receivables'])
 
-df['Year'] = df['Invoice_Date'].dt.year
-df['Year'] = df['Year'].fillna(0).astype(int).astype(str)
-df = df[df['Year'] != '0']
+receivables_columns = ['MP', 'Name', 'Description', 'Due Date', 'Days Overdue', 'Receivables', 'Year', 'Month', 'Invoice_Entity']
+table_columns = ['MP', 'Name', 'Description', 'Due Date', 'Days Overdue', 'Receivables']
 
-df['Month'] = df['Invoice_Date'].dt.strftime('%B')
-today = pd.to_datetime(datetime.now().date())
-df['Days Overdue'] = (today - pd.to_datetime(df['Due Date'])).dt.days.clip(lower=0)
 
-df['Receivables'] = df.apply(
-    lambda row: float(row['Invoice_Amount_USD']) if row['Status'] == 'AUTHORISED' and pd.isna(row['FullyPaidOnDate']) else 0,
-    axis=1
-)
+def receivables_filters(year=None, month=None, entity=None, mp=None, username='admin'):
+    filters = [('Year', year), ('Month', month), ('Invoice_Entity', entity), ('Location', mp)]
+    if username != 'admin':
+        filters.append(('Location', [username]))
+    return filters
+
+
+def receivables_frame(year=None, month=None, entity=None, mp=None, username='admin'):
+    return filter_index.select('INVOICES', receivables_filters(year, month, entity, mp, username), receivables_columns)
+
+
+# The table's filters, sort and filter query as export parameters (see exports.url)
+def view_params(year, month, entity, mp, sort_by, filter_query):
+    return dict(year=year, month=month, entity=entity, mp=mp, filter_query=filter_query,
+                sort_by=json.dumps(sort_by) if sort_by else None)
+
 
-df_display = df[['Location', 'Name', 'Description', 'Due Date', 'Days Overdue', 'Receivables', 'Year', 'Month', 'Invoice_Entity']].copy()
-df_display['MP'] = df_display['Location']
-df_display = df_display[['MP', 'Name', 'Description', 'Due Date', 'Days Overdue', 'Receivables', 'Year', 'Month', 'Invoice_Entity']]
-
-layout = html.Div(style={"backgroundColor": "black", "color": "white"}, children=[
-    html.H2("Receivables Dashboard", style={"textAlign": "center"}),
-
-    html.Div(style={"display": "flex", "gap": "10px", "marginBottom": "20px", "flexWrap": "wrap"}, children=[
-        dcc.Dropdown(
-            id='year-filter',
-            options=[{'label': y, 'value': y} for y in sorted(df_display['Year'].dropna().unique())],
-            placeholder="Filter by Year",
-            style={'width': '250px', 'color': 'green'},
-            multi=True
-        ),
-        dcc.Dropdown(
-            id='month-filter',
-            options=[{'label': m, 'value': m} for m in sorted(df_display['Month'].dropna().unique())],
-            placeholder="Filter by Month",
-            style={'width': '250px', 'color': 'green'},
-            multi=True
-        ),
-        dcc.Dropdown(
-            id='entity-filter',
-            options=[{'label': e, 'value': e} for e in sorted(df_display['Invoice_Entity'].dropna().unique())],
-            placeholder="Filter by Entity",
-            style={'width': '250px', 'color': 'green'},
-            multi=True
-        ),
-        dcc.Dropdown(
-            id='mp-filter',
-            options=[],
-            placeholder="Filter by MP",
-            style={'width': '250px', 'color': 'green'},
-            multi=True
-        )
-    ]),
-
-    dash_table.DataTable(
-        id='receivable-table',
-        columns=[
-            {"name": "MP", "id": "MP"},
-            {"name": "Name", "id": "Name"},
-            {"name": "Description", "id": "Description"},
-            {"name": "Due Date", "id": "Due Date"},
-            {"name": "Days Overdue", "id": "Days Overdue", "type": "numeric"},
-            {"name": "Receivables", "id": "Receivables", "type": "numeric",
-             "format": {"locale": {"symbol": ["$", ""]}, "specifier": "$,d"}}
-        ],
-        page_size=20,
-        style_table={"overflowX": "auto"},
-        style_header={
-            "backgroundColor": "#222",
-            "color": "white",
-            "fontWeight": "bold"
-        },
-        style_cell={
-            "backgroundColor": "#111",
-            "color": "white",
-            "padding": "10px",
-            "textAlign": "left"
-        },
-        style_data_conditional=[
-            {'if': {'row_index': 'odd'}, 'backgroundColor': '#1a1a1a'},
-            {'if': {'column_id': 'Receivables'}, 'textAlign': 'center'},
-            {'if': {'column_id': 'Days Overdue'}, 'textAlign': 'center'},
-        ]
-    ),
-
-    html.Div(id="total_receivable_amount", style={
-        "marginTop": "20px", "fontSize": "18px", "fontWeight": "bold", "textAlign": "right"
-    }),
-
-    html.Div(style={"display": "flex", "justifyContent": "flex-end", "marginTop": "20px"}, children=[
-        html.Button("Export to CSV", id="export-button", n_clicks=0, style={
-            "backgroundColor": "#28a745", "color": "white", "padding": "10px 20px",
-            "border": "none", "borderRadius": "5px", "cursor": "pointer"
-        })
-    ]),
-
-    Download(id="download-receivables")
-])
+# Rows of a view, in display order. update_receivables keeps the rows it shows
+# in the result cache, so exporting the same view from the same web worker
+# reuses them instead of filtering and sorting again.
+def view_rows(snapshot, args, username):
+    key = ('receivables_rows', urllib.parse.urlencode(list(args.items(multi=True))), username, snapshot.version)
+    rows = result_cache.get(key)
+    if rows is None:
+        filters = receivables_filters(args.getlist('year'), args.getlist('month'), args.getlist('entity'),
+                                      args.getlist('mp'), username)
+        rows = filter_index.ordered_rows(snapshot, filters, table_columns,
+                                         json.loads(args.get('sort_by', '[]')), args.get('filter_query', ''))
+        result_cache.put(key, rows, rows.nbytes)
+    return rows
+
+
+def layout():
+    df_display = receivables_frame()
+    return html.Div(style={"backgroundColor": "black", "color": "white"}, children=[
+        html.H2("Receivables Dashboard", style={"textAlign": "center"}),
+
+        html.Div(style={"display": "flex", "gap": "10px", "marginBottom": "20px", "flexWrap": "wrap"}, children=[
+            dcc.Dropdown(
+                id='year-filter',
+                options=[{'label': y, 'value': y} for y in sorted(df_display['Year'].dropna().unique())],
+                placeholder="Filter by Year",
+                style={'width': '250px', 'color': 'green'},
+                multi=True
+            ),
+            dcc.Dropdown(
+                id='month-filter',
+                options=[{'label': m, 'value': m} for m in sorted(df_display['Month'].dropna().unique())],
+                placeholder="Filter by Month",
+                style={'width': '250px', 'color': 'green'},
+                multi=True
+            ),
+            dcc.Dropdown(
+                id='entity-filter',
+                options=[{'label': e, 'value': e} for e in sorted(df_display['Invoice_Entity'].dropna().unique())],
+                placeholder="Filter by Entity",
+                style={'width': '250px', 'color': 'green'},
+                multi=True
+            ),
+            dcc.Dropdown(
+                id='mp-filter',
+                options=[],
+                placeholder="Filter by MP",
+                style={'width': '250px', 'color': 'green'},
+                multi=True
+            )
+        ]),
+
+        # Aging of the receivables in view, next to the table
+        html.Div(style={"display": "flex", "gap": "20px", "flexWrap": "wrap", "alignItems": "flex-start"}, children=[
+            html.Div(style={"flex": "3 1 600px", "minWidth": 0}, children=[
+                dash_table.DataTable(
+                    id='receivable-table',
+                    columns=[
+                        {"name": "MP", "id": "MP"},
+                        {"name": "Name", "id": "Name"},
+                        {"name": "Description", "id": "Description"},
+                        {"name": "Due Date", "id": "Due Date"},
+                        {"name": "Days Overdue", "id": "Days Overdue", "type": "numeric"},
+                        {"name": "Receivables", "id": "Receivables", "type": "numeric",
+                         "format": {"locale": {"symbol": ["$", ""]}, "specifier": "$,d"}}
+                    ],
+                    # Paged, sorted and filtered in update_receivables; only the visible page is sent
+                    page_action="custom",
+                    page_current=0,
+                    page_size=20,
+                    sort_action="custom",
+                    sort_mode="multi",
+                    sort_by=[],
+                    filter_action="custom",
+                    filter_query="",
+                    style_table={"overflowX": "auto"},
+                    style_header={
+                        "backgroundColor": "#222",
+                        "color": "white",
+                        "fontWeight": "bold"
+                    },
+                    style_cell={
+                        "backgroundColor": "#111",
+                        "color": "white",
+                        "padding": "10px",
+                        "textAlign": "left"
+                    },
+                    style_data_conditional=[
+                        {'if': {'row_index': 'odd'}, 'backgroundColor': '#1a1a1a'},
+                        {'if': {'column_id': 'Receivables'}, 'textAlign': 'center'},
+                        {'if': {'column_id': 'Days Overdue'}, 'textAlign': 'center'},
+                    ]
+                )
+            ]),
+            html.Div(style={"flex": "2 1 400px"}, children=[
+                html.Div(id="aging-cards", style={"display": "flex", "gap": "10px", "flexWrap": "wrap"}),
+                dcc.RadioItems(
+                    id="aging-split",
+                    options=[{"label": " By MP", "value": "MP"}, {"label": " By Entity", "value": "Invoice_Entity"}],
+                    value="Invoice_Entity",
+                    inline=True,
+                    inputStyle={"marginLeft": "15px"},
+                    style={"marginTop": "15px"}
+                ),
+                dcc.Graph(id="aging-histogram", style={"height": "400px"})
+            ])
+        ]),
+
+        html.Div(id="total_receivable_amount", style={
+            "marginTop": "20px", "fontSize": "18px", "fontWeight": "bold", "textAlign": "right"
+        }),
+
+        # Written in the background by export_jobs; the link appears when it's ready
+        html.Div(style={"display": "flex", "justifyContent": "flex-end", "alignItems": "center", "gap": "10px", "marginTop": "20px"}, children=[
+            html.Div(id="receivables-export-status")
+        ] + [
+            html.Button(label, id=f"receivables-export-{fmt}-button", n_clicks=0, style={
+                "backgroundColor": "#28a745", "color": "white", "padding": "10px 20px",
+                "border": "none", "borderRadius": "5px", "cursor": "pointer"
+            })
+            for fmt, label in [("csv", "Export to CSV"), ("parquet", "Export to Parquet"), ("xlsx", "Export to Excel")]
+        ]),
+        dcc.Store(id="receivables-export-job"),
+        dcc.Interval(id="receivables-export-poll", interval=1000, disabled=True)
+    ])
 
 
 @callback(
@@ -132,67 +177,121 @@ def update_mp_filter(user_data):
     if username != 'admin':
         mp_options = [{'label': username, 'value': username}]
     else:
+        df_display = receivables_frame()
         mp_options = [{'label': mp, 'value': mp} for mp in sorted(df_display['MP'].dropna().unique())]
     return mp_options
 
 
 @callback(
     Output('receivable-table', 'data'),
+    Output('receivable-table', 'page_count'),
+    Output('receivable-table', 'page_current'),
     Output('total_receivable_amount', 'children'),
     Input('year-filter', 'value'),
     Input('month-filter', 'value'),
     Input('entity-filter', 'value'),
     Input('mp-filter', 'value'),
-    Input('user-store', 'data')
+    Input('user-store', 'data'),
+    Input('receivable-table', 'page_current'),
+    Input('receivable-table', 'page_size'),
+    Input('receivable-table', 'sort_by'),
+    Input('receivable-table', 'filter_query')
 )
-def update_receivables(year, month, entity, mp, user_data):
+def update_receivables(year, month, entity, mp, user_data, page_current, page_size, sort_by, filter_query):
     username = user_data.get("username")
-    dff = df_display.copy()
+    snapshot = data_store.snapshot('INVOICES')
+    args = exports.query_args(view_params(year, month, entity, mp, sort_by, filter_query))
+    rows = view_rows(snapshot, args, username)
+    total_value = np.nansum(snapshot.df['Receivables'].to_numpy()[rows])
 
-    if username != 'admin':
-        dff = dff[dff["MP"] == username]
+    # Changing the filters starts again from the first page
+    if not {'receivable-table.page_current', 'receivable-table.sort_by'} & set(ctx.triggered_prop_ids):
+        page_current = 0
+
+    data, pages = table_paging.page_rows(snapshot.df[table_columns], rows, page_current, page_size)
+    return data, pages, page_current, f"Total Receivables: ${total_value:,.0f}"
+
+
+aging_colors = {'Current': '#28a745', '1-30': '#9acd32', '31-60': '#ffc107', '61-90': '#fd7e14', '90+': '#dc3545'}
 
-    if year:
-        dff = dff[dff['Year'].isin(year)]
-    if month:
-        dff = dff[dff['Month'].isin(month)]
-    if entity:
-        dff = dff[dff['Invoice_Entity'].isin(entity)]
-    if mp:
-        dff = dff[dff['MP'].isin(mp)]
 
-    display_data = dff[['MP', 'Name', 'Description', 'Due Date', 'Days Overdue', 'Receivables']]
-    total_value = display_data['Receivables'].sum()
-    return display_data.to_dict('records'), f"Total Receivables: ${total_value:,.0f}"
+def aging_card(bucket, amount):
+    return html.Div(style={
+        "backgroundColor": "#222", "borderRadius": "8px", "padding": "10px 15px", "minWidth": "110px",
+        "borderLeft": f"4px solid {aging_colors[bucket]}"
+    }, children=[
+        html.Div(f"${amount:,.0f}", style={"fontSize": "18px", "fontWeight": "bold"}),
+        html.Div(bucket if bucket == 'Current' else f"{bucket} days", style={"fontSize": "13px", "color": "#bbb"})
+    ])
 
 
 @callback(
-    Output("download-receivables", "data"),
-    Input("export-button", "n_clicks"),
+    Output('aging-cards', 'children'),
+    Output('aging-histogram', 'figure'),
     Input('year-filter', 'value'),
     Input('month-filter', 'value'),
     Input('entity-filter', 'value'),
     Input('mp-filter', 'value'),
     Input('user-store', 'data'),
+    Input('receivable-table', 'filter_query'),
+    Input('aging-split', 'value')
+)
+@result_cache.memoize('receivables_aging', 'INVOICES')
+def update_aging(year, month, entity, mp, user_data, filter_query, split):
+    username = user_data.get("username")
+    snapshot = data_store.snapshot('INVOICES')
+    filters = receivables_filters(year, month, entity, mp, username)
+    rows = filter_index.rows(snapshot, filters)
+    if filter_query:
+        rows = filter_index.ordered_rows(snapshot, filters, table_columns, None, filter_query)
+
+    by_group = receivables_aging.totals(snapshot, rows, split)
+    by_group = by_group.loc[:, by_group.sum() != 0]
+    cards = [aging_card(bucket, amount) for bucket, amount in by_group.sum(axis=1).items()]
+
+    fig = go.Figure([go.Bar(name=str(group), x=receivables_aging.buckets, y=by_group[group]) for group in by_group.columns])
+    fig.update_layout(
+        barmode="stack", paper_bgcolor="black", plot_bgcolor="black", font_color="white",
+        title="Receivables Aging (days overdue)", yaxis=dict(tickprefix="$", showgrid=False),
+        xaxis=dict(showgrid=False), legend=dict(orientation="h", y=-0.15)
+    )
+    return cards, fig
+
+
+@callback(
+    Output('receivables-export-job', 'data'),
+    Output('receivables-export-status', 'children'),
+    Output('receivables-export-poll', 'disabled'),
+    Input('receivables-export-csv-button', 'n_clicks'),
+    Input('receivables-export-parquet-button', 'n_clicks'),
+    Input('receivables-export-xlsx-button', 'n_clicks'),
+    Input('receivables-export-poll', 'n_intervals'),
+    State('year-filter', 'value'),
+    State('month-filter', 'value'),
+    State('entity-filter', 'value'),
+    State('mp-filter', 'value'),
+    State('receivable-table', 'sort_by'),
+    State('receivable-table', 'filter_query'),
+    State('receivables-export-job', 'data'),
     prevent_initial_call=True
 )
-def export_to_csv(n_clicks, year, month, entity, mp, user_data):
-    if not ctx.triggered_id == "export-button":
-        return dash.no_update
+def run_export(csv_clicks, parquet_clicks, xlsx_clicks, n_intervals, year, month, entity, mp, sort_by,
+               filter_query, job_id):
+    username = flask.request.authorization.username
+    if ctx.triggered_id != 'receivables-export-poll':
+        fmt = ctx.triggered_id.split('-')[2]
+        params = view_params(year, month, entity, mp, sort_by, filter_query)
+        job_id = export_jobs.submit('receivables', fmt, params, username)
+    elif not job_id:
+        return dash.no_update, dash.no_update, True
+    status, stopped = export_jobs.status_view(job_id, username)
+    return job_id, status, stopped
 
-    username = user_data.get("username")
-    dff = df_display.copy()
 
-    if username != 'admin':
-        dff = dff[dff["MP"] == username]
-
-    if year:
-        dff = dff[dff['Year'].isin(year)]
-    if month:
-        dff = dff[dff['Month'].isin(month)]
-    if entity:
-        dff = dff[dff['Invoice_Entity'].isin(entity)]
-    if mp:
-        dff = dff[dff['MP'].isin(mp)]
-
-    return send_data_frame(dff.to_csv, "receivables_export.csv", index=False)
+# Rows for exports of receivables, in the order the table shows them
+def export_rows(args, username):
+    snapshot = data_store.snapshot('INVOICES')
+    return snapshot.df[receivables_columns], view_rows(snapshot, args, username)
+
+
+exports.register('receivables', export_rows, 'receivables_export', 'INVOICES', receivables_columns)
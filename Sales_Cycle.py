@@ -1,38 +1,35 @@
-import pandas as pd
 from dash import html, dcc, dash_table, Input, Output
 import dash_bootstrap_components as dbc
-import urllib
-from sqlalchemy import create_engine
 from dash import ctx
-from dash.dependencies import State
-from dash import Dash
-from dash.dcc import send_data_frame
-
-# ✅ Fetch data from SSMS
-server = 'valentasql.database.windows.net'   
-database = 'Xero_CRM'                         
-username = 'valdb'                            
-password = 'Valenta@1234'                     
-table_name = 'dbo.DEALS'                      
-
-params = urllib.parse.quote_plus(
-    f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-    f"SERVER={server};"
-    f"DATABASE={database};"
-    f"UID={username};"
-    f"PWD={password};"
-)
-
-engine = create_engine(f"mssql+pyodbc:///?odbc_connect={params}")
-df = pd.read_sql(f"SELECT * FROM {table_name}", engine)
-
-# Clean and prepare the data
-df = df[["Deal Owner Name", "Deal Name", "Stage", "Closing Date", "Sales Cycle Duration", "Billing Company"]].dropna()
-df["Closing Date"] = pd.to_datetime(df["Closing Date"], errors='coerce')
-sales_cycle = round(df["Sales Cycle Duration"].mean(), 2)
+
+import data_store
+import exports
+import table_paging
+
+# Columns this page reads from DEALS
+data_store.require_columns('DEALS', ['Deal Owner Name', 'Deal Name', 'Stage', 'Closing Date', 'Sales Cycle Duration', 'Billing Company'])
+
+
+# Keep only the columns the sales cycle table needs
+def sales_cycle_data():
+    df = data_store.deals()
+    return df[["Deal Owner Name", "Deal Name", "Stage", "Closing Date", "Sales Cycle Duration", "Billing Company"]].dropna()
+
+
+def filtered_sales_cycle(year, month, deal_owner, billing_company):
+    filtered_df = sales_cycle_data()
+    if year:
+        filtered_df = filtered_df[filtered_df["Closing Date"].dt.year.isin(year)]
+    if month:
+        filtered_df = filtered_df[filtered_df["Closing Date"].dt.month.isin(month)]
+    if deal_owner:
+        filtered_df = filtered_df[filtered_df["Deal Owner Name"].isin(deal_owner)]
+    if billing_company:
+        filtered_df = filtered_df[filtered_df["Billing Company"].isin(billing_company)]
+    return filtered_df
+
 
 # Dropdown options
-years = sorted(df["Closing Date"].dt.year.dropna().unique())
 months = [ 
     {'label': 'January', 'value': 1}, 
     {'label': 'February', 'value': 2}, 
@@ -47,144 +44,172 @@ months = [
     {'label': 'November', 'value': 11}, 
     {'label': 'December', 'value': 12}
 ]
-deal_owners = sorted(df["Deal Owner Name"].unique())
-billing_companies = sorted(df["Billing Company"].dropna().unique())
 
 # Layout
-sales_cycle_layout = dbc.Container([
-    dbc.Row([
-        dbc.Col([
-            dcc.Dropdown(
-                id='year_filter_sales_cycle',
-                options=[{'label': y, 'value': y} for y in years],
-                placeholder='Year',
-                clearable=True,
-                multi=True,
-                style={'color': 'green', 'backgroundColor': 'white'}
-            ),
-        ], width=2),
-
-        dbc.Col([
-            dcc.Dropdown(
-                id='month_filter_sales_cycle',
-                options=months,
-                placeholder='Month',
-                clearable=True,
-                multi=True,
-                style={'color': 'green', 'backgroundColor': 'white'}
-            ),
-        ], width=2),
-
-        dbc.Col([
-            dcc.Dropdown(
-                id='deal_owner_filter_sales_cycle',
-                options=[{'label': d, 'value': d} for d in deal_owners],
-                placeholder='Deal Owner Name',
-                clearable=True,
-                multi=True,
-                style={'color': 'green', 'backgroundColor': 'white'}
-            ),
-        ], width=3),
-
-        dbc.Col([
-            dcc.Dropdown(
-                id='billing_company_filter_sales_cycle',
-                options=[{'label': b, 'value': b} for b in billing_companies],
-                placeholder='Billing Company',
-                clearable=True,
-                multi=True,
-                style={'color': 'green', 'backgroundColor': 'white'}
-            ),
-        ], width=3),
-    ], className="mb-4"),
-
-    dbc.Row([
-        dbc.Col(
-            dbc.Card(
-                dbc.CardBody([
-                    html.H2(f"{sales_cycle}", className="text-center", style={'color': 'black'}),
-                    html.H5("Sales Cycle", className="text-center", style={'color': 'black'})
-                ]),
-                style={
-                    'backgroundColor': '#FFD700',
-                    'borderRadius': '10px',
-                    'padding': '10px',
-                    'boxShadow': '0 4px 8px rgba(0, 0, 0, 0.3)'
-                }
-            ),
-            width=2
-        )
-    ], className="mb-4"),
-
-    dbc.Row([
-        dbc.Col(
-            dash_table.DataTable(
-                id='deal_table_sales_cycle',
-                columns=[
-                    {'name': 'Deal Owner Name', 'id': 'Deal Owner Name'},
-                    {'name': 'Deal Name', 'id': 'Deal Name'},
-                    {'name': 'Sales Cycle Duration', 'id': 'Sales Cycle Duration'},
-                    {'name': 'Stage', 'id': 'Stage'},
-                    {'name': 'Billing Company', 'id': 'Billing Company'},
-                ],
-                data=df.to_dict("records"),
-                page_size=15,  # Increased page size for bigger table
-                style_table={'overflowX': 'auto', 'minHeight': '500px'},  # Bigger height
-                style_cell={
-                    'textAlign': 'left',
-                    'padding': '10px',
-                    'color': 'white',
-                    'backgroundColor': 'black'
-                },
-                style_header={
-                    'backgroundColor': 'darkgray',
-                    'fontWeight': 'bold'
-                }
-            ),
-            width=12
-        )
-    ]),
-
-    dbc.Row([
-        dbc.Col([], width=9),  # Empty column to push button to right
-        dbc.Col([
-            dbc.Button("Export CSV", id="export_sales_cycle_btn", color="success", className="mt-3"),
-            dcc.Download(id="download_sales_cycle_csv")
-        ], width=3, style={'textAlign': 'right'})
-    ])
-], fluid=True)
+def sales_cycle_layout():
+    df = sales_cycle_data()
+    sales_cycle = round(df["Sales Cycle Duration"].mean(), 2)
+    years = sorted(df["Closing Date"].dt.year.dropna().unique())
+    deal_owners = sorted(df["Deal Owner Name"].unique())
+    billing_companies = sorted(df["Billing Company"].dropna().unique())
+
+    return dbc.Container([
+        dbc.Row([
+            dbc.Col([
+                dcc.Dropdown(
+                    id='year_filter_sales_cycle',
+                    options=[{'label': y, 'value': y} for y in years],
+                    placeholder='Year',
+                    clearable=True,
+                    multi=True,
+                    style={'color': 'green', 'backgroundColor': 'white'}
+                ),
+            ], width=2),
+
+            dbc.Col([
+                dcc.Dropdown(
+                    id='month_filter_sales_cycle',
+                    options=months,
+                    placeholder='Month',
+                    clearable=True,
+                    multi=True,
+                    style={'color': 'green', 'backgroundColor': 'white'}
+                ),
+            ], width=2),
+
+            dbc.Col([
+                dcc.Dropdown(
+                    id='deal_owner_filter_sales_cycle',
+                    options=[{'label': d, 'value': d} for d in deal_owners],
+                    placeholder='Deal Owner Name',
+                    clearable=True,
+                    multi=True,
+                    style={'color': 'green', 'backgroundColor': 'white'}
+                ),
+            ], width=3),
+
+            dbc.Col([
+                dcc.Dropdown(
+                    id='billing_company_filter_sales_cycle',
+                    options=[{'label': b, 'value': b} for b in billing_companies],
+                    placeholder='Billing Company',
+                    clearable=True,
+                    multi=True,
+                    style={'color': 'green', 'backgroundColor': 'white'}
+                ),
+            ], width=3),
+        ], className="mb-4"),
+
+        dbc.Row([
+            dbc.Col(
+                dbc.Card(
+                    dbc.CardBody([
+                        html.H2(f"{sales_cycle}", className="text-center", style={'color': 'black'}),
+                        html.H5("Sales Cycle", className="text-center", style={'color': 'black'})
+                    ]),
+                    style={
+                        'backgroundColor': '#FFD700',
+                        'borderRadius': '10px',
+                        'padding': '10px',
+                        'boxShadow': '0 4px 8px rgba(0, 0, 0, 0.3)'
+                    }
+                ),
+                width=2
+            )
+        ], className="mb-4"),
+
+        dbc.Row([
+            dbc.Col(
+                dash_table.DataTable(
+                    id='deal_table_sales_cycle',
+                    columns=[
+                        {'name': 'Deal Owner Name', 'id': 'Deal Owner Name'},
+                        {'name': 'Deal Name', 'id': 'Deal Name'},
+                        {'name': 'Sales Cycle Duration', 'id': 'Sales Cycle Duration'},
+                        {'name': 'Stage', 'id': 'Stage'},
+                        {'name': 'Billing Company', 'id': 'Billing Company'},
+                    ],
+                    # Starts empty; update_table sends one page at a time
+                    data=[],
+                    page_action="custom",
+                    page_current=0,
+                    page_size=15,  # Increased page size for bigger table
+                    style_table={'overflowX': 'auto', 'minHeight': '500px'},  # Bigger height
+                    style_cell={
+                        'textAlign': 'left',
+                        'padding': '10px',
+                        'color': 'white',
+                        'backgroundColor': 'black'
+                    },
+                    style_header={
+                        'backgroundColor': 'darkgray',
+                        'fontWeight': 'bold'
+                    }
+                ),
+                width=12
+            )
+        ]),
+
+        dbc.Row([
+            dbc.Col([], width=9),  # Empty column to push button to right
+            dbc.Col([
+                # Streamed by the /export route with the current filters (see exports.py)
+                dbc.Button(label, id=f"export_sales_cycle_{fmt}", href="", external_link=True,
+                           color="success", className="mt-3 ms-2")
+                for fmt, label in [("csv", "Export CSV"), ("parquet", "Parquet"), ("xlsx", "Excel")]
+            ], width=3, style={'textAlign': 'right'})
+        ])
+    ], fluid=True)
 
 
 # Callback to filter data
 def register_sales_cycle_callbacks(app):
     @app.callback(
-        Output('deal_table_sales_cycle', 'data'),
+        [
+            Output('deal_table_sales_cycle', 'data'),
+            Output('deal_table_sales_cycle', 'page_count'),
+            Output('deal_table_sales_cycle', 'page_current'),
+        ],
         [
             Input('year_filter_sales_cycle', 'value'),
             Input('month_filter_sales_cycle', 'value'),
             Input('deal_owner_filter_sales_cycle', 'value'),
             Input('billing_company_filter_sales_cycle', 'value'),
+            Input('deal_table_sales_cycle', 'page_current'),
+            Input('deal_table_sales_cycle', 'page_size'),
         ]
     )
-    def update_table(year, month, deal_owner, billing_company):
-        filtered_df = df.copy()
-        if year:
-            filtered_df = filtered_df[filtered_df["Closing Date"].dt.year.isin(year)]
-        if month:
-            filtered_df = filtered_df[filtered_df["Closing Date"].dt.month.isin(month)]
-        if deal_owner:
-            filtered_df = filtered_df[filtered_df["Deal Owner Name"].isin(deal_owner)]
-        if billing_company:
-            filtered_df = filtered_df[filtered_df["Billing Company"].isin(billing_company)]
-        return filtered_df.to_dict("records")
-
-    # ✅ Export CSV Callback
+    def update_table(year, month, deal_owner, billing_company, page_current, page_size):
+        filtered_df = filtered_sales_cycle(year, month, deal_owner, billing_company)
+        # Changing the filters starts again from the first page
+        if ctx.triggered_id != 'deal_table_sales_cycle':
+            page_current = 0
+        data, pages = table_paging.page(filtered_df, page_current, page_size)
+        return data, pages, page_current
+
+    # ✅ Export links follow the filters
     @app.callback(
-        Output("download_sales_cycle_csv", "data"),
-        Input("export_sales_cycle_btn", "n_clicks"),
-        State('deal_table_sales_cycle', 'data'),
-        prevent_initial_call=True,
+        [
+            Output('export_sales_cycle_csv', 'href'),
+            Output('export_sales_cycle_parquet', 'href'),
+            Output('export_sales_cycle_xlsx', 'href'),
+        ],
+        [
+            Input('year_filter_sales_cycle', 'value'),
+            Input('month_filter_sales_cycle', 'value'),
+            Input('deal_owner_filter_sales_cycle', 'value'),
+            Input('billing_company_filter_sales_cycle', 'value'),
+        ]
     )
-    def export_csv(n_clicks, table_data):
-        export_df = pd.DataFrame(table_data)
-        return send_data_frame(export_df.to_csv, filename="Sales_Cycle_Deals.csv", index=False)
+    def update_export_links(year, month, deal_owner, billing_company):
+        params = dict(year=year, month=month, deal_owner=deal_owner, billing_company=billing_company)
+        return [exports.url('sales_cycle', fmt, **params) for fmt in ['csv', 'parquet', 'xlsx']]
+
+
+# Rows for /export/sales_cycle.<format>
+def export_rows(args, username):
+    return filtered_sales_cycle(args.getlist('year', type=int), args.getlist('month', type=int),
+                                args.getlist('deal_owner'), args.getlist('billing_company')), None
+
+
+exports.register('sales_cycle', export_rows, 'Sales_Cycle_Deals', 'DEALS')
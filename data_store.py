@@ -0,0 +1,479 @@
+import itertools
+import os
+import threading
+import time
+import urllib.parse
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+# Copy-on-write lets every page filter the shared frames without deep copies
+# and guarantees a page can never write back into them (always on in pandas >= 3).
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+try:
+    import pyarrow  # noqa: F401
+    arrow_strings = "str" if int(pd.__version__.split(".")[0]) >= 3 else "string[pyarrow_numpy]"
+except ImportError:
+    arrow_strings = None
+
+# SQL setup
+server = 'valentasql.database.windows.net'
+database = 'Xero_CRM'
+username = 'valdb'
+password = 'Valenta@1234'
+
+params = urllib.parse.quote_plus(
+    f"DRIVER={{ODBC Driver 17 for SQL Server}};"
+    f"SERVER={server};DATABASE={database};UID={username};PWD={password};"
+)
+engine = sqlalchemy.create_engine(f"mssql+pyodbc:///?odbc_connect={params}", pool_pre_ping=True)
+
+closed_stages = ['Closed-Won', 'Closed (Lost)', 'Closed (Future prospect)']
+
+
+def prepare_invoices(df):
+    df['Invoice_Date'] = pd.to_datetime(df['Invoice_Date'], errors='coerce')
+    df = df[df['Invoice_Date'].notna()].copy()
+
+    df['Year'] = df['Invoice_Date'].dt.year.astype(int).astype(str)
+    df['Quarter'] = df['Invoice_Date'].dt.to_period("Q").astype(str)
+    df['Month'] = df['Invoice_Date'].dt.month_name()
+    df['Invoice Date'] = df['Invoice_Date'].dt.strftime('%Y-%m-%d')
+
+    df['Location'] = df['Location'].fillna("Unknown")
+    df['MP'] = df['Location']
+    df['Name'] = df['Client_Name'].fillna("")
+    df['Invoice Amount'] = pd.to_numeric(df['Invoice_Amount_USD'], errors='coerce').abs().fillna(0)
+
+    # Receivables. 'Due Day' is the due date as a day number (days since
+    # 1970-01-01); age_invoices turns it into 'Days Overdue' for a given day.
+    due_date = pd.to_datetime(df['Invoice_DueDate'])
+    df['Due Date'] = due_date.dt.strftime('%Y-%m-%d')
+    df['Due Day'] = (due_date.dt.normalize() - pd.Timestamp(0)).dt.days
+    unpaid = (df['Status'] == 'AUTHORISED') & df['FullyPaidOnDate'].isna()
+    df['Receivables'] = pd.to_numeric(df['Invoice_Amount_USD'], errors='coerce').where(unpaid, 0).astype(float)
+    return df
+
+
+def day_number(day):
+    return (pd.Timestamp(day) - pd.Timestamp(0)).days
+
+
+def age_invoices(df, day):
+    return df.assign(**{'Days Overdue': (day_number(day) - df['Due Day']).clip(lower=0)})
+
+
+def prepare_deals(df):
+    for col in ["Amount", "Consulting Fee"]:
+        if col in df.columns and not df[col].isnull().all():
+            df[col] = df[col].astype(str).replace({r'[$,]': ''}, regex=True)
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+
+    df['Created Time'] = pd.to_datetime(df['Created Time'], errors='coerce')
+    df['Closing Date'] = pd.to_datetime(df['Closing Date'], errors='coerce')
+    df['Closing Month'] = df['Closing Date'].dt.strftime("%b-%Y")
+
+    # Missing owners and stages stay missing here: Sales Cycle drops those
+    # deals, and Deals Closing shows a missing owner as "Unknown" itself
+    df['# Deals Entered'] = 1
+    df['Is Closed'] = df['Stage'].isin(closed_stages)
+    return df
+
+
+# This month's and next month's 'Closing Month' labels
+def closing_months():
+    today = pd.Timestamp(date.today())
+    return today.strftime("%b-%Y"), (today + pd.DateOffset(months=1)).strftime("%b-%Y")
+
+
+def prepare_accounts(df):
+    df = df.rename(columns=lambda x: x.strip())
+    df = df[['Account Name', 'Account Owner Name', 'Existing Account']]
+
+    # Simulate Score Bucket
+    df['Score Bucket'] = np.random.RandomState(42).choice(
+        ['Under 50', '50-100', '100-150', 'Over 150'],
+        size=len(df),
+        p=[0.7, 0.2, 0.05, 0.05]
+    )
+    return df
+
+
+# 'columns' starts as the raw columns the prepare step reads; pages add the
+# ones they use through require_columns and only their union is selected.
+# Tables with 'refresh' are kept up to date by the background refresher. When
+# the source table has both the 'watermark' column (a modification time or
+# rowversion) and the 'key' column (a unique id), a refresh reads only the rows
+# modified since the newest one loaded and replaces them by key. Without them it
+# re-reads only the rows whose 'window' date column is within the lookback of
+# the newest one, replacing that trailing window; a table with neither isn't
+# refreshed.
+# Tables with a 'ttl' (seconds) are reloaded in full by the refresher once
+# they are that old; pages keep reading the loaded snapshot meanwhile.
+# 'daily' computes the columns that depend on the current date; it runs on
+# every new snapshot and again, without a reload, once the date changes.
+tables = {
+    'INVOICES': {
+        'table_name': 'dbo.INVOICES',
+        'prepare': prepare_invoices,
+        'columns': {'Invoice_Date', 'Invoice_DueDate', 'Location', 'Client_Name',
+                    'Invoice_Amount_USD', 'Status', 'FullyPaidOnDate'},
+        'refresh': True,
+        'watermark': os.environ.get('INVOICES_WATERMARK_COLUMN', 'UpdatedDateUTC'),
+        'key': os.environ.get('INVOICES_KEY_COLUMN', 'InvoiceID'),
+        'window': 'Invoice_Date',
+        'daily': age_invoices,
+    },
+    'DEALS': {
+        'table_name': 'dbo.DEALS',
+        'prepare': prepare_deals,
+        'columns': {'Amount', 'Consulting Fee', 'Created Time', 'Closing Date', 'Stage', 'Deal Owner Name'},
+    },
+    'ACCOUNTS': {
+        'table_name': 'dbo.ACCOUNTS',
+        'prepare': prepare_accounts,
+        'columns': {'Account Name', 'Account Owner Name', 'Existing Account'},
+        'ttl': int(os.environ.get('ACCOUNTS_TTL_SECONDS', 600)),
+    },
+}
+
+refresh_interval = int(os.environ.get('DATA_REFRESH_SECONDS', 300))
+# How far behind the newest modification time a refresh looks again, so rows
+# whose transactions committed out of order are still picked up
+refresh_overlap = pd.Timedelta(seconds=int(os.environ.get('DATA_REFRESH_OVERLAP_SECONDS', 60)))
+# How far back a refresh without the watermark and key columns re-reads rows:
+# changes to older ones only show up after a restart
+refresh_lookback = pd.Timedelta(days=int(os.environ.get('DATA_REFRESH_LOOKBACK_DAYS', 90)))
+
+# Set by gunicorn.conf.py when the app is preloaded in the gunicorn master:
+# the master then loads and refreshes the tables, and workers only read them.
+preload = False
+
+_snapshots = {}
+_versions = itertools.count(1)
+_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+
+
+# One immutable, versioned copy of a table together with everything derived
+# from it. A refresh builds the next Snapshot off to the side and swaps it in
+# with a single assignment, so a callback that grabbed the previous one keeps
+# reading a consistent version until it returns, without any lock.
+class Snapshot:
+    def __init__(self, name, df, version, day):
+        self.name = name
+        self.df = df
+        self.version = version
+        self.day = day
+        self.loaded_at = pd.Timestamp.now()
+        self._derived = {}
+        # Reentrant: building one derived structure may read another
+        self._derived_lock = threading.RLock()
+
+    def frame(self):
+        # Shallow copy: shares the column buffers, but columns a page adds or
+        # overwrites stay local to that page.
+        return self.df.copy(deep=False)
+
+    def derived(self, key, build):
+        if key not in self._derived:
+            with self._derived_lock:
+                if key not in self._derived:
+                    self._derived[key] = build(self)
+        return self._derived[key]
+
+
+# Structures built from a table (indexes, aggregates, ...) that should be
+# ready before a new snapshot of that table is published
+def register_derived(name, key, build):
+    tables[name].setdefault('derived', {})[key] = build
+
+
+def publish(name, df):
+    day = date.today()
+    if 'daily' in tables[name]:
+        df = tables[name]['daily'](df, day)
+    snapshot = Snapshot(name, df, next(_versions), day)
+    for key, build in tables[name].get('derived', {}).items():
+        snapshot.derived(key, build)
+    _snapshots[name] = snapshot
+    return snapshot
+
+
+def require_columns(name, columns):
+    spec = tables[name]
+    missing = set(columns) - spec['columns']
+    spec['columns'] |= missing
+    # A page registered after the table was loaded: reload it on next use
+    if missing and name in _snapshots:
+        with _lock:
+            _snapshots.pop(name, None)
+
+
+def available_columns(name):
+    spec = tables[name]
+    if 'available' not in spec:
+        schema, table = spec['table_name'].split('.')
+        spec['available'] = [c['name'] for c in sqlalchemy.inspect(engine).get_columns(table, schema=schema)]
+    return spec['available']
+
+
+def select_list(name):
+    spec = tables[name]
+    wanted = spec['columns'] | {c for c in (spec.get('watermark'), spec.get('key')) if c}
+    # Columns a page only uses when present (e.g. DEALS.Region) are skipped
+    # rather than breaking the query. Some ACCOUNTS columns carry stray
+    # spaces in their names, so match on the stripped name.
+    return ", ".join(f"[{c}]" for c in available_columns(name) if c.strip() in wanted)
+
+
+# Keep text columns in Arrow buffers rather than one Python object per cell:
+# workers forked from a preloading master then read them without touching
+# refcounts, so the memory pages stay shared. pandas >= 3 already stores
+# strings this way when pyarrow is installed.
+def compact(df):
+    if arrow_strings is None:
+        return df
+    for col in df.columns:
+        if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True) == 'string':
+            df[col] = df[col].astype(arrow_strings)
+    return df
+
+
+def read_raw(name, where="", params=None):
+    spec = tables[name]
+    query = sqlalchemy.text(f"SELECT {select_list(name)} FROM {spec['table_name']} {where}")
+    return pd.read_sql(query, engine, params=params)
+
+
+def read(name, where="", params=None):
+    return compact(tables[name]['prepare'](read_raw(name, where, params)))
+
+
+def load(name):
+    return read(name)
+
+
+# Older than the table's ttl
+def expired(name):
+    ttl = tables[name].get('ttl')
+    return ttl is not None and (pd.Timestamp.now() - _snapshots[name].loaded_at).total_seconds() > ttl
+
+
+# Loaded on an earlier day than today, and has date-dependent columns
+def rolled_over(name):
+    return 'daily' in tables[name] and _snapshots[name].day != date.today()
+
+
+def snapshot(name):
+    if name not in _snapshots:
+        with _lock:
+            if name not in _snapshots:
+                publish(name, load(name))
+    # A preloading master republishes tables when the date changes and forks
+    # new workers from them
+    elif rolled_over(name) and not preload:
+        with _lock:
+            if rolled_over(name):
+                publish(name, _snapshots[name].df)
+    return _snapshots[name]
+
+
+def get(name):
+    return snapshot(name).frame()
+
+
+def _sql_value(value):
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    return value.item() if hasattr(value, 'item') else value
+
+
+# Whether the source table has the columns for an incremental refresh
+def incremental(name):
+    spec = tables[name]
+    available = {c.strip() for c in available_columns(name)}
+    return bool(spec.get('watermark') and spec.get('key')) and {spec['watermark'], spec['key']} <= available
+
+
+# Whether the rows of delta differ from the loaded rows with the same keys
+def _changed(current, delta, key):
+    old = current.loc[current[key].isin(delta[key]), delta.columns]
+    if len(old) != len(delta):
+        return True
+    return not old.set_index(key).sort_index().equals(delta.set_index(key).sort_index())
+
+
+# Whether two sets of rows differ, whatever their order
+def _rows_differ(old, new):
+    if len(old) != len(new):
+        return True
+    hashes = [np.sort(pd.util.hash_pandas_object(rows, index=False).to_numpy()) for rows in (old, new)]
+    return not np.array_equal(*hashes)
+
+
+_warned = set()
+
+
+def _warn_once(name, message):
+    if name not in _warned:
+        _warned.add(name)
+        print(f"WARNING: {name}: {message}")
+
+
+# Replaces the rows dated within refresh_lookback of the newest loaded one
+# with what the table has now. A row whose date moves across the start of the
+# window keeps its old version until the next full load.
+def _refresh_window(name, current):
+    spec = tables[name]
+    column = spec['window']
+    start = min(current[column].max(), pd.Timestamp.now().normalize()) - refresh_lookback
+    if pd.isna(start):
+        return False
+    delta = read(name, f"WHERE [{column}] >= :start", {'start': _sql_value(start)})
+    trailing = current[column] >= start
+    if not _rows_differ(current.loc[trailing, delta.columns], delta):
+        return False
+    publish(name, pd.concat([current[~trailing], delta], ignore_index=True))
+    return True
+
+
+# Brings a loaded table up to date; returns whether a new snapshot was published
+def refresh(name):
+    spec = tables[name]
+    if not spec.get('refresh') or name not in _snapshots:
+        return False
+
+    with _refresh_lock:
+        current = _snapshots[name].df
+        column, key = spec.get('watermark'), spec.get('key')
+        watermark = current[column].max() if incremental(name) else None
+        if pd.isna(watermark):
+            if 'window' not in spec:
+                _warn_once(name, f"no [{column}]/[{key}] columns to refresh by; "
+                                 "the table is only reloaded on restart")
+                return False
+            _warn_once(name, f"no [{column}]/[{key}] columns to refresh by; re-reading only the "
+                             f"last {refresh_lookback.days} days by [{spec['window']}]")
+            return _refresh_window(name, current)
+        if isinstance(watermark, pd.Timestamp):
+            watermark -= refresh_overlap
+
+        raw = read_raw(name, f"WHERE [{column}] >= :watermark", {'watermark': _sql_value(watermark)})
+        delta = compact(spec['prepare'](raw.copy()))
+        # Rows the prepare step drops (e.g. an invoice whose date was cleared)
+        # still remove their old version
+        kept = current[~current[key].isin(raw[key])]
+        if len(kept) + len(delta) == len(current) and not _changed(current, delta, key):
+            return False
+        publish(name, pd.concat([kept, delta], ignore_index=True))
+        return True
+
+
+def invoices():
+    return get('INVOICES')
+
+
+def deals():
+    return get('DEALS')
+
+
+def accounts():
+    return get('ACCOUNTS')
+
+
+# Reloads a loaded table that is older than its ttl; returns whether a new
+# snapshot was published. An unchanged table keeps its snapshot (and the
+# workers forked from it), which then counts as just loaded.
+def reload(name):
+    if name not in _snapshots or not expired(name):
+        return False
+
+    with _refresh_lock:
+        current = _snapshots[name]
+        df = load(name)
+        if df.equals(current.df[df.columns]):
+            current.loaded_at = pd.Timestamp.now()
+            return False
+        with _lock:
+            publish(name, df)
+        return True
+
+
+# Load every table in the background so the first page view rarely waits on
+# the database. A failed warmup is retried by the first page that needs it,
+# and by the refresher. Returns whether any table got a new snapshot.
+def warmup():
+    published = False
+    for name in tables:
+        try:
+            before = _snapshots.get(name)
+            published |= snapshot(name) is not before
+        except Exception as e:
+            print(f"Error warming up {name} data: {e}")
+    return published
+
+
+# on_loaded is called once the warmup published anything
+def start_warmup(on_loaded=None):
+    def run():
+        if warmup() and on_loaded:
+            on_loaded()
+
+    thread = threading.Thread(target=run, name="data-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+# Periodically merge new and changed rows into the loaded tables, reload the
+# expired ones, redo the date-dependent columns once the date changes, and load
+# the tables that failed to load so far; returns whether any table got a new
+# snapshot
+def refresh_all():
+    published = False
+    for name in tables:
+        try:
+            if name in _snapshots:
+                if refresh(name) or reload(name):
+                    published = True
+                elif rolled_over(name):
+                    with _lock:
+                        publish(name, _snapshots[name].df)
+                    published = True
+            else:
+                snapshot(name)
+                published = True
+        except Exception as e:
+            print(f"Error refreshing {name} data: {e}")
+    return published
+
+
+# on_refresh is only called after a refresh that published a new snapshot
+def _refresh_loop(on_refresh=None):
+    while True:
+        # Wake up right after midnight too, for the date-dependent columns
+        midnight = pd.Timestamp.now().normalize() + pd.Timedelta(days=1)
+        time.sleep(min(refresh_interval, (midnight - pd.Timestamp.now()).total_seconds() + 1))
+        if refresh_all() and on_refresh:
+            on_refresh()
+
+
+def start_refresher(on_refresh=None):
+    thread = threading.Thread(target=_refresh_loop, args=(on_refresh,), name="data-refresh", daemon=True)
+    thread.start()
+    return thread
+
+
+# For a process forked while the warmup or refresher thread may have held one
+# of the locks: that thread doesn't exist in the child, so nothing would ever
+# release them
+def reset_locks():
+    global _lock, _refresh_lock
+    _lock = threading.Lock()
+    _refresh_lock = threading.Lock()
+    for current in _snapshots.values():
+        current._derived_lock = threading.RLock()
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+
+import data_store
+
+# Closing rate by cohort: deals are grouped by the month they were created in,
+# and each cohort reports the share of its deals closed within 0, 1, ...
+# months of that month. A deal is a distinct (owner, deal name) pair, counted
+# the way the owner table on Deals Closing counts it: created in the earliest
+# month of its rows, and closed (in the earliest closing month) if any of its
+# rows is. Created and closing months are turned into integer month numbers
+# once per snapshot, so the matrix for a filtered set of rows is a pass over
+# their deal codes, two bincounts and a running sum along each cohort.
+horizon = 12
+
+data_store.require_columns('DEALS', ['Deal Owner Name', 'Deal Name', 'Created Time', 'Closing Date', 'Stage'])
+
+# Month number of no date, later than any real one (and exact as a float)
+never = np.iinfo(np.int32).max
+
+
+# Codes for counting distinct deals, built once per snapshot: each row's owner
+# (numbered in name order, a missing owner being "Unknown") and its (owner,
+# deal) pair, with the row's closed flag as the pair code's lowest bit. Rows
+# without a deal name get -1 and count as no deal.
+def build_deal_codes(snapshot):
+    df = snapshot.df
+    owners, names = pd.factorize(df['Deal Owner Name'].fillna('Unknown'), sort=True)
+    deals, deal_names = pd.factorize(df['Deal Name'])
+    width = max(len(deal_names), 1)
+    pairs = owners.astype(np.int64) * width + deals
+    codes = np.where(deals >= 0, pairs * 2 + df['Is Closed'].to_numpy(), -1)
+    return owners, names, codes, width
+
+
+data_store.register_derived('DEALS', 'deal_codes', build_deal_codes)
+
+
+# Months since year 0 (year * 12 + month - 1), `never` where there's no date
+def month_numbers(dates):
+    return (dates.dt.year * 12 + dates.dt.month - 1).fillna(never).to_numpy(dtype=np.int64)
+
+
+def month_label(number):
+    return pd.Timestamp(year=number // 12, month=number % 12 + 1, day=1).strftime("%b-%Y")
+
+
+class CohortIndex:
+    def __init__(self, df, codes):
+        self._codes = codes
+        self._created = month_numbers(df['Created Time'])
+        # Closing month of the closed rows
+        self._closing = np.where(df['Is Closed'].to_numpy(), month_numbers(df['Closing Date']), never)
+
+    # Closing rate (%) per cohort month (rows) and months to close (columns,
+    # 0 to horizon) for rows (row positions, None for all rows), and the number
+    # of deals per cohort. Cells later than `day`'s month have no rate yet.
+    def matrix(self, day, rows=None):
+        codes, created, closing = self._codes, self._created, self._closing
+        if rows is not None:
+            codes, created, closing = codes[rows], created[rows], closing[rows]
+        named = codes >= 0
+        deal, pairs = pd.factorize(codes[named] // 2)
+        created_month = np.full(len(pairs), never)
+        np.minimum.at(created_month, deal, created[named])
+        closing_month = np.full(len(pairs), never)
+        np.minimum.at(closing_month, deal, closing[named])
+
+        dated = created_month != never
+        created = created_month[dated]
+        # Months from creation to closing, -1 for deals that are open or have
+        # no closing date; closing before the created month counts as 0
+        lag = np.where(closing_month[dated] != never, np.maximum(closing_month[dated] - created, 0), -1)
+        columns = np.arange(horizon + 1)
+        if not len(created):
+            return pd.DataFrame(columns=columns, dtype=float), pd.Series(dtype=np.int64)
+
+        first = created.min()
+        cohort = created - first
+        count = cohort.max() + 1
+        deals = np.bincount(cohort, minlength=count)
+        within = (lag >= 0) & (lag <= horizon)
+        closed = np.bincount(cohort[within] * (horizon + 1) + lag[within],
+                             minlength=count * (horizon + 1)).reshape(count, horizon + 1).cumsum(axis=1)
+
+        rate = closed / np.maximum(deals, 1)[:, None] * 100
+        months = first + np.arange(count)
+        today = pd.Timestamp(day)
+        rate[months[:, None] + columns > today.year * 12 + today.month - 1] = np.nan
+
+        # Months nobody created a deal in are left out
+        keep = deals > 0
+        labels = [month_label(number) for number in months[keep]]
+        return pd.DataFrame(rate[keep], index=labels, columns=columns), pd.Series(deals[keep], index=labels)
+
+
+def build(snapshot):
+    return CohortIndex(snapshot.df, snapshot.derived('deal_codes', build_deal_codes)[2])
+
+
+# Rebuilt with every new DEALS snapshot before it is published, after the
+# deal codes it reads
+data_store.register_derived('DEALS', 'cohorts', build)
+
+
+def matrix(snapshot, rows=None):
+    return snapshot.derived('cohorts', build).matrix(snapshot.day, rows)
@@ -0,0 +1,213 @@
+import concurrent.futures
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+import flask
+from dash import html
+
+import data_store
+import exports
+import result_cache
+
+# Exports as background jobs: the page submits one, polls its progress and then
+# downloads the finished file. The web worker only hands the dataset name and
+# filters (or, for a dataset of snapshot columns, the row positions it picked)
+# to a small pool of writer processes, which build the extract and write the
+# file, so a large extract never holds up a web worker. Job state and finished files are
+# kept in EXPORT_JOB_DIR where every gunicorn worker can see them, and a file is
+# reused for an identical request (same dataset, format, filters, user and data)
+# for EXPORT_JOB_TTL_SECONDS.
+job_dir = os.environ.get('EXPORT_JOB_DIR', os.path.join(tempfile.gettempdir(), 'dashboard_exports'))
+ttl = int(os.environ.get('EXPORT_JOB_TTL_SECONDS', 900))
+workers = int(os.environ.get('EXPORT_JOB_WORKERS', 2))
+
+blueprint = flask.Blueprint('export_jobs', __name__)
+# Per table, the snapshot version its pool was forked with and the pool
+_pools = {}
+_lock = threading.Lock()
+
+
+def _path(job_id, suffix):
+    return os.path.join(job_dir, f'{job_id}.{suffix}')
+
+
+# A job that hasn't reported progress for this long lost its writer process
+# (e.g. the worker that started it was restarted)
+stall_seconds = 120
+
+
+def _fresh(path, seconds):
+    try:
+        return os.path.getmtime(path) > time.time() - seconds
+    except OSError:
+        return False
+
+
+def _save_state(job_id, state):
+    tmp = _path(job_id, f'json.{os.getpid()}')
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, _path(job_id, 'json'))
+
+
+def load_state(job_id):
+    try:
+        with open(_path(job_id, 'json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# Drop the state and files of jobs older than the TTL
+def _expire():
+    cutoff = time.time() - ttl
+    for entry in os.scandir(job_dir):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+
+# Runs in a pool process: takes the rows of the export (those picked by the
+# web worker, or else built here) from the snapshot the process was forked
+# with, writes them to a temporary file, reporting the rows written so far,
+# then moves it into place
+def _write(job_id, state, name, args, username, version, rows=None):
+    build, _, table, columns = exports.dataset(name)
+    write, _ = exports.formats[state['fmt']]
+    part = _path(job_id, f"{state['fmt']}.{os.getpid()}.part")
+
+    def progress(done, total):
+        _save_state(job_id, dict(state, done=done, total=total))
+
+    try:
+        if data_store.snapshot(table).version != version:
+            raise RuntimeError("the data was refreshed, please start the export again")
+        if columns and rows is not None:
+            df = data_store.snapshot(table).df[columns]
+        else:
+            df, rows = build(args, username)
+        if rows is not None:
+            df = df.take(rows)
+        progress(0, len(df))
+        with open(part, 'wb') as f:
+            for data in write(df, None, progress):
+                f.write(data.encode() if isinstance(data, str) else data)
+        os.replace(part, _path(job_id, state['fmt']))
+        _save_state(job_id, dict(state, done=len(df), total=len(df), finished=True))
+    except Exception as e:
+        print(f"Error writing export {state['filename']}: {e}")
+        _save_state(job_id, dict(state, error=str(e)))
+        if os.path.exists(part):
+            os.remove(part)
+
+
+# The writer processes start as forks of this worker and read its snapshots,
+# so a new snapshot of the table gets a new pool; the old one finishes its
+# jobs and exits. Other threads of the worker may have held a lock at the
+# fork, which nothing in the child would ever release.
+def _init_writer():
+    data_store.reset_locks()
+    result_cache.reset_locks()
+
+
+def _executor(table, version):
+    with _lock:
+        current = _pools.get(table)
+        if current is None or current[0] != version:
+            if current is not None:
+                current[1].shutdown(wait=False)
+            pool = concurrent.futures.ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context('fork'), initializer=_init_writer)
+            _pools[table] = current = (version, pool)
+        return current[1]
+
+
+def _done(job_id, state, table, pool, future):
+    error = future.exception()
+    if error is None:
+        return
+    # The pool can't run anything once a writer process has died
+    if isinstance(error, concurrent.futures.process.BrokenProcessPool):
+        with _lock:
+            if table in _pools and _pools[table][1] is pool:
+                del _pools[table]
+    _save_state(job_id, dict(state, error=str(error) or type(error).__name__))
+
+
+# Starts (or finds) the export of dataset name in format fmt, for the filters
+# in params (as for exports.url) and returns its job id
+def submit(name, fmt, params, username):
+    build, filename, table, columns = exports.dataset(name)
+    os.makedirs(job_dir, exist_ok=True)
+
+    args = exports.query_args(params)
+    snapshot = data_store.snapshot(table)
+    key = (name, fmt, sorted(args.items(multi=True)), username, snapshot.derived('fingerprint', result_cache.fingerprint))
+    job_id = hashlib.sha1(repr(key).encode()).hexdigest()
+
+    # Finished or still running (in this worker or another one)
+    if _alive(job_id, load_state(job_id)):
+        return job_id
+
+    _expire()
+    state = dict(user=username, fmt=fmt, filename=f'{filename}.{fmt}')
+    _save_state(job_id, dict(state, done=0, total=0))
+    # Picking the rows of snapshot columns is an index lookup (or a result
+    # cache hit), and only the positions go to the writer
+    rows = build(args, username)[1] if columns else None
+    pool = _executor(table, snapshot.version)
+    future = pool.submit(_write, job_id, state, name, args, username, snapshot.version, rows)
+    future.add_done_callback(lambda f: _done(job_id, state, table, pool, f))
+    return job_id
+
+
+def _alive(job_id, state):
+    if not state or state.get('error'):
+        return False
+    if state.get('finished'):
+        return _fresh(_path(job_id, state['fmt']), ttl)
+    return _fresh(_path(job_id, 'json'), stall_seconds)
+
+
+def status(job_id, username):
+    # Job ids are sha1 hex digests; anything else never names a job file
+    if not job_id or len(job_id) != 40 or job_id.strip('0123456789abcdef'):
+        return None
+    state = load_state(job_id)
+    if not state or state['user'] != username:
+        return None
+    return state
+
+
+# What the page shows for a job, and whether it has stopped (finished, failed
+# or gone) so the page can stop polling
+def status_view(job_id, username):
+    state = status(job_id, username)
+    if state and state.get('error'):
+        return html.Span(f"Export failed: {state['error']}", style={"color": "red"}), True
+    if not _alive(job_id, state):
+        return html.Span("This export has expired, please start it again."), True
+    if state.get('finished'):
+        return html.A(f"Download {state['filename']}", href=f"/export/jobs/{job_id}",
+                      style={"color": "white", "fontWeight": "bold"}), True
+    return html.Div([
+        html.Progress(value=str(state['done']), max=str(max(state['total'], 1)), style={"width": "200px"}),
+        html.Span(f" Preparing export: {state['done']:,} of {state['total']:,} rows" if state['total']
+                  else " Preparing export")
+    ]), False
+
+
+@blueprint.route('/export/jobs/<job_id>')
+def download(job_id):
+    state = status(job_id, flask.request.authorization.username)
+    if not _alive(job_id, state) or not state.get('finished'):
+        flask.abort(404)
+    return flask.send_file(_path(job_id, state['fmt']), mimetype=exports.formats[state['fmt']][1],
+                           as_attachment=True, download_name=state['filename'])
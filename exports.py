@@ -0,0 +1,148 @@
+import io
+import os
+import tempfile
+import urllib.parse
+
+import flask
+import pyarrow as pa
+import pyarrow.parquet as pq
+import xlsxwriter
+from werkzeug.datastructures import MultiDict
+
+# Downloads of the large tables: GET /export/<dataset>.<format> with the page's
+# filters in the query string. Rows are gathered from the server-side snapshot
+# a chunk at a time and written out as they go, so neither the worker nor the
+# browser ever holds the whole extract.
+chunk_rows = int(os.environ.get('EXPORT_CHUNK_ROWS', 50000))
+
+blueprint = flask.Blueprint('exports', __name__)
+_datasets = {}
+
+
+# build(args, username) returns the frame to export and the row positions to
+# write, in order (None for all rows). args are the request's query args.
+# table is the data_store table the rows come from. With columns, build
+# returns those columns of the table's snapshot and picks the rows from it.
+def register(name, build, filename, table, columns=None):
+    _datasets[name] = (build, filename, table, columns)
+
+
+def dataset(name):
+    return _datasets.get(name)
+
+
+def query(params):
+    return urllib.parse.urlencode({k: v for k, v in params.items() if v not in (None, [], '')}, doseq=True)
+
+
+# The args a request to url(name, fmt, **params) would carry
+def query_args(params):
+    return MultiDict(urllib.parse.parse_qsl(query(params)))
+
+
+def url(name, fmt, **params):
+    q = query(params)
+    return f"/export/{name}.{fmt}" + (f"?{q}" if q else "")
+
+
+# progress(done, total) is called once each chunk has been written
+def chunks(df, rows, progress=None):
+    total = len(df) if rows is None else len(rows)
+    for start in range(0, max(total, 1), chunk_rows):
+        if rows is None:
+            yield df.iloc[start:start + chunk_rows]
+        else:
+            yield df.take(rows[start:start + chunk_rows])
+        if progress:
+            progress(min(start + chunk_rows, total), total)
+
+
+def write_csv(df, rows, progress=None):
+    header = True
+    for chunk in chunks(df, rows, progress):
+        yield chunk.to_csv(index=False, header=header)
+        header = False
+
+
+# File-like sink that hands over whatever the Parquet writer produced since
+# the last call, so each row group can be sent as soon as it is written
+class _Sink(io.RawIOBase):
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def write_parquet(df, rows, progress=None):
+    schema = pa.Schema.from_pandas(df.iloc[:0], preserve_index=False)
+    # Empty object columns have no type yet; they hold text
+    schema = pa.schema([f.with_type(pa.string()) if pa.types.is_null(f.type) else f for f in schema])
+
+    sink = _Sink()
+    writer = pq.ParquetWriter(sink, schema)
+    for chunk in chunks(df, rows, progress):
+        writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+# constant_memory makes xlsxwriter flush every finished row to a temporary
+# file; the workbook is then assembled on disk and streamed from there. Rows
+# past Excel's limit of 1,048,576 are dropped by xlsxwriter.
+def write_xlsx(df, rows, progress=None):
+    with tempfile.TemporaryFile() as f:
+        workbook = xlsxwriter.Workbook(f, {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd'})
+        worksheet = workbook.add_worksheet()
+        worksheet.write_row(0, 0, list(df.columns))
+        row = 1
+        for chunk in chunks(df, rows, progress):
+            values = chunk.astype(object).where(chunk.notna(), None)
+            for record in values.itertuples(index=False, name=None):
+                worksheet.write_row(row, 0, record)
+                row += 1
+        workbook.close()
+
+        f.seek(0)
+        while True:
+            data = f.read(1 << 20)
+            if not data:
+                break
+            yield data
+
+
+formats = {
+    'csv': (write_csv, 'text/csv'),
+    'parquet': (write_parquet, 'application/vnd.apache.parquet'),
+    'xlsx': (write_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+
+@blueprint.route('/export/<name>.<fmt>')
+def export(name, fmt):
+    if name not in _datasets or fmt not in formats:
+        flask.abort(404)
+    build, filename, _, _ = _datasets[name]
+    write, mimetype = formats[fmt]
+
+    df, rows = build(flask.request.args, flask.request.authorization.username)
+    return flask.Response(
+        flask.stream_with_context(write(df, rows)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}.{fmt}"'}
+    )
@@ -0,0 +1,147 @@
+import numpy as np
+import pandas as pd
+
+import data_store
+import table_paging
+
+
+# Row-id index over the columns pages filter on. For every column it keeps the
+# integer code of each row and, per value, the sorted ids of the rows holding
+# it. A set of isin-style filters resolves to row ids by taking the rows of the
+# most selective filter and narrowing them with a code lookup per remaining
+# filter, so the cost follows the number of matching rows, not the table size.
+class FilterIndex:
+    def __init__(self, df, columns):
+        self.size = len(df)
+        self._codes = {}
+        self._lookup = {}
+        self._order = {}
+        self._offsets = {}
+        for column in columns:
+            codes, uniques = pd.factorize(df[column])
+            codes = codes.astype(np.int32)
+            order = np.argsort(codes, kind='stable').astype(np.int32)
+            self._codes[column] = codes
+            self._lookup[column] = {value: code for code, value in enumerate(uniques)}
+            self._order[column] = order
+            # Missing values (code -1) sort first and belong to no value
+            self._offsets[column] = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+
+    def _selected_codes(self, column, values):
+        lookup = self._lookup[column]
+        return [lookup[value] for value in values if value in lookup]
+
+    def _count(self, column, codes):
+        offsets = self._offsets[column]
+        return sum(offsets[code + 1] - offsets[code] for code in codes)
+
+    # filters is a list of (column, values); empty values mean "no filter".
+    # Returns the matching row positions in table order, or None if nothing
+    # is filtered.
+    def rows(self, filters):
+        active = [(column, self._selected_codes(column, values)) for column, values in filters if values]
+        if not active:
+            return None
+
+        active.sort(key=lambda item: self._count(*item))
+        column, codes = active[0]
+        order, offsets = self._order[column], self._offsets[column]
+        parts = [order[offsets[code]:offsets[code + 1]] for code in codes]
+        rows = np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int32)
+
+        for column, codes in active[1:]:
+            # One extra slot so missing values (code -1) never match
+            keep = np.zeros(len(self._lookup[column]) + 1, dtype=bool)
+            keep[codes] = True
+            rows = rows[keep[self._codes[column][rows]]]
+        return rows
+
+
+# Row orders of numeric columns, ascending and descending, computed once per
+# snapshot. Sorting a filtered subset keeps the rows of the precomputed order
+# that pass the filter, instead of sorting the subset on every request. Both
+# directions are stable and put missing values last, like sort_values.
+class SortIndex:
+    def __init__(self, df, columns):
+        self.size = len(df)
+        self._orders = {}
+        for column in columns:
+            values = df[column].to_numpy(dtype=float)
+            self._orders[(column, 'asc')] = np.argsort(values, kind='stable').astype(np.int32)
+            self._orders[(column, 'desc')] = np.argsort(-values, kind='stable').astype(np.int32)
+
+    def __contains__(self, column):
+        return (column, 'asc') in self._orders
+
+    # Row positions in sorted order, limited to rows (all rows if None)
+    def order(self, column, direction, rows=None):
+        order = self._orders[(column, direction)]
+        if rows is None:
+            return order
+        keep = np.zeros(self.size, dtype=bool)
+        keep[rows] = True
+        return order[keep[order]]
+
+
+_dimensions = {}
+_sort_columns = {}
+
+
+def build(snapshot):
+    return FilterIndex(snapshot.df, _dimensions[snapshot.name])
+
+
+def build_sort(snapshot):
+    return SortIndex(snapshot.df, _sort_columns[snapshot.name])
+
+
+def register(name, columns):
+    _dimensions[name] = list(dict.fromkeys(_dimensions.get(name, []) + list(columns)))
+    data_store.register_derived(name, 'filter_index', build)
+
+
+def register_sort(name, columns):
+    _sort_columns[name] = list(dict.fromkeys(_sort_columns.get(name, []) + list(columns)))
+    data_store.register_derived(name, 'sort_index', build_sort)
+
+
+# Matching row positions of a snapshot, or None if nothing is filtered
+def rows(snapshot, filters):
+    return snapshot.derived('filter_index', build).rows(filters)
+
+
+def sort_index(snapshot):
+    return snapshot.derived('sort_index', build_sort)
+
+
+# The given columns of rows, indexed by row position
+def positional_frame(snapshot, rows, columns):
+    positions = np.arange(len(snapshot.df)) if rows is None else rows
+    return snapshot.df[columns].take(positions).set_axis(positions)
+
+
+# Row positions of a server-side DataTable in display order: the page filters
+# through the filter index, then the table's own filter_query, then its sort_by.
+# A single-column sort on a registered sort column slices the sort index.
+def ordered_rows(snapshot, filters, columns, sort_by=None, filter_query=None):
+    positions = rows(snapshot, filters)
+    if filter_query:
+        positions = table_paging.filter_frame(positional_frame(snapshot, positions, columns), filter_query).index.to_numpy()
+
+    if len(sort_by or []) == 1 and sort_by[0]['column_id'] in _sort_columns.get(snapshot.name, []):
+        return sort_index(snapshot).order(sort_by[0]['column_id'], sort_by[0]['direction'], positions)
+    if sort_by:
+        return table_paging.sort_frame(positional_frame(snapshot, positions, columns), sort_by).index.to_numpy()
+    return np.arange(len(snapshot.df)) if positions is None else positions
+
+
+# Filter a table through its index and gather the requested columns once
+def select(name, filters, columns=None):
+    snapshot = data_store.snapshot(name)
+    positions = rows(snapshot, filters)
+    df = snapshot.frame() if columns is None else snapshot.df[columns]
+    return df if positions is None else df.take(positions)
+
+
+# The standard invoice filters: MP (Location), Year, Quarter, Month and entity
+register('INVOICES', ['Location', 'Year', 'Quarter', 'Month', 'Invoice_Entity'])
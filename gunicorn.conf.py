@@ -0,0 +1,48 @@
+import gc
+import os
+import signal
+
+import data_store
+
+# Preload mode: the master imports the app and loads INVOICES and DEALS once,
+# and the workers forked from it share those snapshots copy-on-write instead
+# of each reading its own copy. The master loads them in the background so a
+# slow database doesn't hold up boot; until then workers load what they need
+# themselves, and once it's done they are replaced by workers forked from the
+# loaded snapshots. Set DATA_PRELOAD=0 to have every worker load and refresh
+# its own data again.
+preload_app = os.environ.get('DATA_PRELOAD', '1') == '1'
+data_store.preload = preload_app
+
+
+def _freeze():
+    # Objects in the permanent generation are never scanned by the cyclic GC,
+    # which would otherwise write to (and so copy) every shared page
+    gc.unfreeze()
+    gc.collect()
+    gc.freeze()
+
+
+# Reload (SIGHUP) so new workers fork from the master's new snapshots and the
+# old ones finish their requests
+def _reload_workers():
+    os.kill(os.getpid(), signal.SIGHUP)
+
+
+def when_ready(server):
+    if preload_app:
+        _freeze()
+        data_store.start_warmup(on_loaded=_reload_workers)
+        data_store.start_refresher(on_refresh=_reload_workers)
+
+
+def on_reload(server):
+    if preload_app:
+        _freeze()
+
+
+def post_fork(server, worker):
+    # Database connections opened in the master must not be used by the workers
+    data_store.engine.dispose(close=False)
+    if preload_app:
+        data_store.reset_locks()
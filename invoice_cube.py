@@ -0,0 +1,32 @@
+import data_store
+
+# Pre-aggregated INVOICES: one row per (Year, Quarter, Month, Invoice_Entity,
+# Location) with the sums the Overview and Entity Breakdown pages report.
+# Row-level differences (Paid_Amount, Receivables) are summed per cell, so
+# missing amounts are skipped exactly as a row-level groupby would skip them.
+dimensions = ['Year', 'Quarter', 'Month', 'Invoice_Entity', 'Location']
+measures = ['Invoice_Amount_USD', 'Quantity', 'Paid_Amount', 'Receivables', 'Invoices']
+
+data_store.require_columns('INVOICES', ['Invoice_Entity', 'Location', 'Invoice_Amount_USD', 'Quantity'])
+
+
+def build(snapshot):
+    df = snapshot.df
+    paid = df['Invoice_Amount_USD'] - df['Quantity']
+    cells = df[dimensions].assign(
+        Invoice_Amount_USD=df['Invoice_Amount_USD'],
+        Quantity=df['Quantity'],
+        Paid_Amount=paid,
+        Receivables=df['Invoice_Amount_USD'] - paid,
+        Invoices=1,
+    )
+    # dropna=False keeps invoices without an Invoice_Entity in the totals
+    return cells.groupby(dimensions, dropna=False).sum().reset_index()
+
+
+# Rebuilt with every new INVOICES snapshot before it is published
+data_store.register_derived('INVOICES', 'cube', build)
+
+
+def cube():
+    return data_store.snapshot('INVOICES').derived('cube', build)
@@ -7,7 +7,11 @@ import dash_auth
 from flask import request
 import os
 
-# Import layouts and callbacks
+import data_store
+import export_jobs
+import exports
+
+# Import layouts and callbacks (pages load their data on first use, not at import)
 from Invoice_details import layout as invoice_layout
 from Receivables_details import layout as receivables_layout
 from Overview import layout as overview_layout, register_callbacks as register_overview_callbacks
@@ -37,6 +41,11 @@ app = dash.Dash(
 app.title = "Valenta Invoice & Sales Dashboard"
 app.server.secret_key = '12345678'
 
+# Streaming table exports (/export/<dataset>.<format>) and background export
+# jobs (/export/jobs/<job id>)
+server.register_blueprint(exports.blueprint)
+server.register_blueprint(export_jobs.blueprint)
+
 # 3. Auth setup
 auth = dash_auth.BasicAuth(app, VALID_USERNAME_PASSWORD_PAIRS)
 
@@ -103,6 +112,14 @@ register_deals_closing_callbacks(app)
 register_sales_cycle_callbacks(app)
 register_accounts_callbacks(app)
 
+# Preloaded by the gunicorn master: gunicorn.conf.py loads and refreshes the
+# data there once the server is up, and the workers share its snapshots
+if not data_store.preload:
+    # Start loading INVOICES and DEALS without holding up worker boot, then keep
+    # them up to date in the background
+    data_store.start_warmup()
+    data_store.start_refresher()
+
 # 8. Store username in dcc.Store
 @app.callback(
     Output("user-store", "data"),
@@ -124,28 +141,35 @@ def display_page(pathname):
             html.P("To fully log out, please close this browser tab or clear your browser cache."),
             html.P("Due to HTTP Basic Auth limitations, full logout is handled by the browser.")
         ])
-    if pathname in ["/", "/overview"]:
-        return overview_layout
-    elif pathname == "/entity":
-        return entity_layout
-    elif pathname == "/invoice":
-        return invoice_layout
-    elif pathname == "/receivables":
-        return receivables_layout
-    elif pathname == "/client":
-        return client_layout
-    elif pathname == "/franchise":
-        return franchise_layout
-    elif pathname == "/graphs":
-        return graphs_layout
-    elif pathname == "/accounts_score":
-        return accounts_layout
-    elif pathname == "/deals_closing":
-        return deals_closing_layout
-    elif pathname == "/sales_cycle":
-        return sales_cycle_layout
-    else:
-        return overview_layout
+    try:
+        if pathname in ["/", "/overview"]:
+            return overview_layout()
+        elif pathname == "/entity":
+            return entity_layout()
+        elif pathname == "/invoice":
+            return invoice_layout()
+        elif pathname == "/receivables":
+            return receivables_layout()
+        elif pathname == "/client":
+            return client_layout
+        elif pathname == "/franchise":
+            return franchise_layout()
+        elif pathname == "/graphs":
+            return graphs_layout()
+        elif pathname == "/accounts_score":
+            return accounts_layout
+        elif pathname == "/deals_closing":
+            return deals_closing_layout()
+        elif pathname == "/sales_cycle":
+            return sales_cycle_layout()
+        else:
+            return overview_layout()
+    except Exception as e:
+        print(f"Error loading page {pathname}: {e}")
+        return html.Div([
+            html.H2("Data Unavailable", style={"color": "red"}),
+            html.P("The dashboard could not reach the database. Please try again in a few minutes.")
+        ])
 
 # 10. Sidebar active link highlight
 @app.callback(
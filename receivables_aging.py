@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+import data_store
+
+# Receivables aging: each invoice's receivable falls in a bucket by how many
+# days past its due date it is on a given day. The invoices are sorted by due
+# date once per snapshot, so for any day the bucket boundaries are four binary
+# searches into that order. The unfiltered totals are then differences of a
+# running sum, and a filtered set of rows only needs each row's position in the
+# order looked up against those boundaries.
+buckets = ['Current', '1-30', '31-60', '61-90', '90+']
+groups = ['MP', 'Invoice_Entity']
+
+data_store.require_columns('INVOICES', ['Invoice_Entity'])
+
+
+class AgingIndex:
+    def __init__(self, df):
+        due = df['Due Day'].to_numpy(dtype=float)
+        # Stable, and invoices without a due date go last and age into no bucket
+        order = np.argsort(due, kind='stable')
+        self._due = due[order]
+        self._dated = int(np.count_nonzero(~np.isnan(due)))
+        self._position = np.empty(len(df), dtype=np.int64)
+        self._position[order] = np.arange(len(df))
+        self._amounts = np.nan_to_num(df['Receivables'].to_numpy(dtype=float)[order])
+        self._running = np.concatenate([[0], np.cumsum(self._amounts)])
+        self._groups = {}
+        for column in groups:
+            codes, uniques = pd.factorize(df[column].to_numpy()[order], use_na_sentinel=False)
+            self._groups[column] = (codes, ['(none)' if pd.isna(u) else u for u in uniques])
+
+    # Positions in due-date order where each bucket starts and ends, oldest
+    # (90+) first. A receivable due on day `due` is `today - due` days overdue.
+    def _edges(self, today):
+        cuts = np.searchsorted(self._due[:self._dated], [today - 90, today - 60, today - 30, today])
+        return np.concatenate([[0], cuts, [self._dated]])
+
+    # Receivables per bucket on day (a date) for rows (row positions, None for
+    # all rows), as a Series, or as a frame with one column per value of `by`
+    def totals(self, day, rows=None, by=None):
+        edges = self._edges(data_store.day_number(day))
+        if rows is None and by is None:
+            return pd.Series(np.diff(self._running[edges])[::-1], index=buckets)
+
+        positions = np.arange(len(self._amounts)) if rows is None else self._position[rows]
+        # 0 is 90+, ..., 4 is Current and 5 has no due date
+        bucket = np.searchsorted(edges[1:], positions, side='right')
+        if by is None:
+            sums = np.bincount(bucket, weights=self._amounts[positions], minlength=6)
+            return pd.Series(sums[:5][::-1], index=buckets)
+
+        codes, labels = self._groups[by]
+        sums = np.bincount(bucket * len(labels) + codes[positions], weights=self._amounts[positions],
+                           minlength=6 * len(labels)).reshape(6, len(labels))
+        return pd.DataFrame(sums[:5][::-1], index=buckets, columns=labels)
+
+
+def build(snapshot):
+    return AgingIndex(snapshot.df)
+
+
+# Rebuilt with every new INVOICES snapshot before it is published
+data_store.register_derived('INVOICES', 'aging', build)
+
+
+def totals(snapshot, rows=None, by=None):
+    return snapshot.derived('aging', build).totals(snapshot.day, rows, by)
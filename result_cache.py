@@ -0,0 +1,200 @@
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+
+import pandas as pd
+from plotly.io.json import to_json_plotly
+
+import data_store
+
+# Callback results keyed by (page, normalized arguments, snapshot versions of
+# the tables the page reads) and sized by their JSON encoding. The arguments
+# carry the filters and the user-store data (username). A refresh publishes a
+# new version, so entries for the previous one are simply never hit again and
+# age out of the LRU. The date is part of the key too, so pages with
+# "this month"/"next month" filters (which look up the current month on each
+# call) get new results when the date changes.
+max_bytes = int(os.environ.get('RESULT_CACHE_MB', 64)) * 1024 * 1024
+
+# Set RESULT_CACHE_PATH to a SQLite file to share results between gunicorn
+# workers: each worker keeps its own LRU in front of the file, and a result any
+# worker computed is read from the file by the others. Snapshot version numbers
+# are per process, so shared keys use a fingerprint of the table contents.
+# Results are stored as the JSON Dash would send, so reading one back skips
+# rebuilding (and re-validating) the plotly figures.
+shared_path = os.environ.get('RESULT_CACHE_PATH')
+shared_max_bytes = int(os.environ.get('RESULT_CACHE_SHARED_MB', 256)) * 1024 * 1024
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+_total = 0
+
+# One connection to the shared file per thread, and the time each shared
+# result was last read, written back in batches rather than on every read
+_local = threading.local()
+_schema_ready = False
+_touched = {}
+touched_batch = 100
+
+
+# Filters are isin-style multi-selects: None and [] both mean "no filter" and
+# the selection order doesn't change the result.
+def normalize(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, normalize(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        if not value:
+            return None
+        return tuple(sorted((normalize(v) for v in value), key=repr))
+    return value
+
+
+# A callback's arguments keep their positions; only the values selected
+# within each one are put in order
+def normalize_args(args):
+    return tuple(normalize(arg) for arg in args)
+
+
+def fingerprint(snapshot):
+    df = snapshot.df
+    digest = hashlib.sha1(repr(list(df.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+def get(key):
+    with _lock:
+        if key not in _entries:
+            return None
+        _entries.move_to_end(key)
+        return _entries[key][0]
+
+
+def put(key, result, size):
+    global _total
+    if size > max_bytes:
+        return
+    with _lock:
+        if key in _entries:
+            _total -= _entries.pop(key)[1]
+        _entries[key] = (result, size)
+        _total += size
+        while _total > max_bytes:
+            _, (_, evicted) = _entries.popitem(last=False)
+            _total -= evicted
+
+
+def clear():
+    global _total
+    with _lock:
+        _entries.clear()
+        _total = 0
+
+
+# For a process forked while another thread may have held the lock. The
+# connections of the parent's threads aren't used in the child either.
+def reset_locks():
+    global _lock, _local
+    _lock = threading.Lock()
+    _local = threading.local()
+
+
+def _connect():
+    global _schema_ready
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _local.conn = sqlite3.connect(shared_path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+    if not _schema_ready:
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value BLOB, size INTEGER, used REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+        _schema_ready = True
+    return conn
+
+
+def _write_touched(conn):
+    global _touched
+    with _lock:
+        touched, _touched = _touched, {}
+    if touched:
+        conn.executemany("UPDATE results SET used = ? WHERE key = ?", [(used, key) for key, used in touched.items()])
+
+
+def shared_get(key):
+    conn = _connect()
+    row = conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+    if row is None:
+        return None
+    with _lock:
+        _touched[key] = time.time()
+        full = len(_touched) >= touched_batch
+    if full:
+        with conn:
+            _write_touched(conn)
+    return row[0]
+
+
+def shared_put(key, value):
+    if len(value) > shared_max_bytes:
+        return
+    conn = _connect()
+    with conn:
+        _write_touched(conn)
+        conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", (key, value, len(value), time.time()))
+        # Drop least recently used results until the file is back under its cap
+        total, count = conn.execute("SELECT COALESCE(SUM(size), 0), COUNT(*) FROM results").fetchone()
+        while total > shared_max_bytes:
+            # As many of the oldest as results of the average size over the cap
+            oldest = -(-(total - shared_max_bytes) * count // total)
+            conn.execute("DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY used LIMIT ?)", (oldest,))
+            total, count = conn.execute("SELECT COALESCE(SUM(size), 0), COUNT(*) FROM results").fetchone()
+
+
+def memoize(page, *tables):
+    if shared_path:
+        # Fingerprint every new snapshot before it is published
+        for name in tables:
+            data_store.register_derived(name, 'fingerprint', fingerprint)
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            snapshots = [data_store.snapshot(name) for name in tables]
+            versions = tuple(s.version for s in snapshots)
+            key = (page, normalize_args(args), versions, date.today())
+            result = get(key)
+            if result is not None:
+                return result
+
+            shared_key = None
+            if shared_path:
+                fingerprints = tuple(s.derived('fingerprint', fingerprint) for s in snapshots)
+                shared_key = hashlib.sha1(repr((page, key[1], fingerprints, key[3])).encode()).hexdigest()
+                try:
+                    value = shared_get(shared_key)
+                except sqlite3.Error as e:
+                    print(f"Error reading shared result cache: {e}")
+                    value = None
+                if value is not None:
+                    result = json.loads(value)
+                    put(key, result, len(value))
+                    return result
+
+            result = func(*args)
+            value = to_json_plotly(result).encode()
+            put(key, result, len(value))
+            if shared_key:
+                try:
+                    shared_put(shared_key, value)
+                except sqlite3.Error as e:
+                    print(f"Error writing shared result cache: {e}")
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,79 @@
+import pandas as pd
+
+# Server-side paging, sorting and filtering for DataTables with
+# page_action/sort_action/filter_action="custom": the table sends its
+# page_current, page_size, sort_by and filter_query, and gets back only the
+# rows of the visible page plus the page count.
+operators = [['ge ', '>='], ['le ', '<='], ['lt ', '<'], ['gt ', '>'], ['ne ', '!='], ['eq ', '='],
+             ['contains '], ['datestartswith ']]
+
+
+def split_filter_part(filter_part):
+    for operator_type in operators:
+        for operator in operator_type:
+            if operator not in filter_part:
+                continue
+            name_part, value_part = filter_part.split(operator, 1)
+            name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+
+            value_part = value_part.strip()
+            v0 = value_part[0] if value_part else ''
+            if v0 and v0 == value_part[-1] and v0 in ("'", '"', '`'):
+                value = value_part[1:-1].replace('\\' + v0, v0)
+            else:
+                try:
+                    value = float(value_part)
+                except ValueError:
+                    value = value_part
+
+            # word operators need spaces after them in the filter string,
+            # but we don't want these later
+            return name, operator_type[0].strip(), value
+    return [None] * 3
+
+
+def filter_frame(df, filter_query):
+    for filter_part in (filter_query or '').split(' && '):
+        col_name, operator, filter_value = split_filter_part(filter_part)
+        if col_name not in df.columns:
+            continue
+        column = df[col_name]
+
+        if operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
+            if pd.api.types.is_numeric_dtype(column):
+                filter_value = pd.to_numeric(filter_value, errors='coerce')
+            else:
+                filter_value = str(filter_value)
+            df = df.loc[getattr(column, operator)(filter_value)]
+        elif operator == 'contains':
+            df = df.loc[column.astype(str).str.contains(str(filter_value), case=False, regex=False)]
+        elif operator == 'datestartswith':
+            df = df.loc[column.astype(str).str.startswith(str(filter_value))]
+    return df
+
+
+def sort_frame(df, sort_by):
+    sort_by = [s for s in sort_by or [] if s['column_id'] in df.columns]
+    if not sort_by:
+        return df
+    return df.sort_values(
+        [s['column_id'] for s in sort_by],
+        ascending=[s['direction'] == 'asc' for s in sort_by],
+        kind='stable'
+    )
+
+
+def page_count(total, page_size):
+    return max(1, -(-total // page_size))
+
+
+# Rows of one page as records, plus the number of pages
+def page(df, page_current, page_size):
+    start = (page_current or 0) * page_size
+    return df.iloc[start:start + page_size].to_dict('records'), page_count(len(df), page_size)
+
+
+# Same for a frame and the row positions (in display order) it is shown in
+def page_rows(df, rows, page_current, page_size):
+    start = (page_current or 0) * page_size
+    return df.take(rows[start:start + page_size]).to_dict('records'), page_count(len(rows), page_size)